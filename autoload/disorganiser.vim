@@ -0,0 +1,81 @@
+" Loaded on first use (see plugin/disorganiser.vim and ftplugin/disorganiser.vim), so that starting Vim doesn't
+" pay for importing the Python side and building the formula grammar.
+
+let s:plugin_dir = expand('<sfile>:p:h:h') . '/plugin'
+let s:loaded = 0
+
+" Import the Python commands into the namespace the mappings run in. Does nothing after the first time.
+function! disorganiser#load()
+	if s:loaded
+		return
+	endif
+	let s:loaded = 1
+	let plugin_dir = s:plugin_dir
+
+python3 <<EOF
+import sys
+import vim
+
+sys.path.insert(0, vim.eval('l:plugin_dir'))
+
+from disorganiser import dis_indent, dis_indent_visual, dis_indent_subtree, \
+	dis_dedent, dis_dedent_visual, dis_dedent_subtree, \
+	dis_outline_insert_above_children, dis_outline_insert_after_children, \
+	dis_outline_insert_above_current,  dis_list_insert_above_children, dis_tab, \
+	dis_itab, dis_date_insert, dis_cr, dis_table_reformat, \
+	dis_cycle_todo_or_reformat_table, dis_make_table_visual, dis_mouse, \
+	dis_outline_listener, dis_reap_url_openers, dis_fold_levels, dis_highlight, \
+	dis_agenda, dis_scan_poll, dis_search, dis_scan_written
+
+EOF
+endfunction
+
+" 'foldexpr' for g:disorganiser_fold_mode 'expr'. The fold levels of the whole buffer are worked out in Python (see
+" dis_fold_levels), once for each change to it.
+function! disorganiser#foldexpr(lnum)
+	if get(b:, 'disorganiser_fold_changedtick', -1) != b:changedtick
+		call disorganiser#load()
+		let b:disorganiser_fold_levels = py3eval('dis_fold_levels()')
+		let b:disorganiser_fold_changedtick = b:changedtick
+	endif
+	return get(b:disorganiser_fold_levels, a:lnum - 1, 0)
+endfunction
+
+" Highlight the current buffer with text properties rather than the regex syntax (see syntax/disorganiser.vim). Only
+" the lines in and around the window are highlighted, as it moves.
+function! disorganiser#highlight()
+	call disorganiser#load()
+	python3 dis_highlight(reset=True)
+	augroup disorganiser_highlight
+		autocmd! * <buffer>
+		autocmd CursorMoved,CursorMovedI,TextChanged,TextChangedI,BufWinEnter <buffer> python3 dis_highlight()
+		if exists('##WinScrolled')
+			autocmd WinScrolled <buffer> python3 dis_highlight()
+		endif
+	augroup END
+endfunction
+
+" :DisAgenda.
+function! disorganiser#agenda(directory)
+	call disorganiser#load()
+	python3 dis_agenda(vim.eval('a:directory'))
+endfunction
+
+" :DisSearch.
+function! disorganiser#search(query)
+	call disorganiser#load()
+	python3 dis_search(vim.eval('a:query'))
+endfunction
+
+" Keep the multi-file commands' index of the files up to date as they're written.
+function! disorganiser#scan_written(path)
+	call disorganiser#load()
+	python3 dis_scan_written(vim.eval('a:path'))
+endfunction
+
+" :DisProfile. The profiler is only imported when it's first used.
+function! disorganiser#profile(bang)
+	call disorganiser#load()
+	python3 from disprofile import dis_profile
+	execute 'python3 dis_profile("' . a:bang . '")'
+endfunction
@@ -0,0 +1,99 @@
+"""
+Time the agenda's scan (see disscan.py) of a directory of generated files: with an empty cache, read in Vim's
+process and then in the pool of processes; with nothing changed since the last scan; and with a few files changed.
+
+    python3 bench/agenda.py [--files N] [--lines N] [--changed N]
+
+For the pool, the longest tick of the timer (which is all Vim waits for at a time) is shown as well. The files and
+the cache are made in a temporary directory, which is removed afterwards.
+"""
+import argparse
+import contextlib
+import os
+import random
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(BENCH_DIR), 'plugin'))
+sys.path.insert(0, BENCH_DIR)
+
+import corpus
+from disagenda import agenda_items
+from disscan import ScanCache, Scanner, find_files
+
+POLL_INTERVAL = 0.1  # seconds, as SCAN_POLL_MS
+STORE_SECONDS = 0.05  # as SCAN_STORE_SECONDS
+STORE_FILES = 8  # as SCAN_STORE_FILES
+
+def _scan_here(cache, directory):
+    """
+    Returns (num_read, longest wait): everything is read at once, so the wait is the whole scan.
+    """
+    start = time.perf_counter()
+    num_read = cache.scan(directory)
+    return num_read, time.perf_counter() - start
+
+def _scan_in_pool(cache, directory):
+    """
+    Returns (num_read, longest wait), looking for changes and collecting the results at each tick as the timer in
+    Vim does.
+    """
+    time.sleep(POLL_INTERVAL)
+    start = time.perf_counter()
+    stale, removed = cache.changes(directory)
+    cache.update([], removed)
+    scanner = Scanner(stale)
+    longest = time.perf_counter() - start
+
+    parsed = []
+    num_stored = 0
+    while num_stored < len(stale):
+        time.sleep(POLL_INTERVAL)
+        start = time.perf_counter()
+        parsed.extend(scanner.poll())
+        while parsed and time.perf_counter() - start < STORE_SECONDS:
+            cache.update(parsed[:STORE_FILES])
+            num_stored += len(parsed[:STORE_FILES])
+            del parsed[:STORE_FILES]
+        longest = max(longest, time.perf_counter() - start)
+    return len(stale), longest
+
+def _timed_scan(cache_path, directory, scan):
+    start = time.perf_counter()
+    with contextlib.closing(ScanCache(cache_path)) as cache:
+        num_read, longest = scan(cache, directory)
+        num_items = len(agenda_items(cache, directory))
+    return time.perf_counter() - start, longest, num_items, num_read
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Time the agenda's scan.")
+    parser.add_argument('--files', type=int, default=2000, help='number of files (default 2000)')
+    parser.add_argument('--lines', type=int, default=200, help='lines in each file (default 200)')
+    parser.add_argument('--changed', type=int, default=10, help='files to change before the last scan (default 10)')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        directory = os.path.join(temp_dir, 'notes')
+        cache_path = os.path.join(temp_dir, 'cache', 'scan.sqlite3')
+        corpus.write_files(directory, corpus.agenda_files(args.files, args.lines, args.seed))
+
+        print('%d files of %d lines; times in milliseconds' % (args.files, args.lines))
+        print('%-20s %9s %12s %9s %9s' % ('scan', 'total', 'longest wait', 'items', 'read'))
+        for name, scan in (('empty cache', _scan_here), ('empty cache, pool', _scan_in_pool),
+                           ('unchanged', _scan_here), ('changed', _scan_here)):
+            if name == 'empty cache, pool':
+                os.unlink(cache_path)
+            elif name == 'changed':
+                rng = random.Random(args.seed)
+                for path in rng.sample(sorted(find_files(directory)), args.changed):
+                    with open(path, 'a', encoding='utf-8') as f:
+                        f.write('\n* TODO added <2025-06-01>')
+
+            elapsed, longest, num_items, num_read = _timed_scan(cache_path, directory, scan)
+            print('%-20s %9.1f %12.1f %9d %9d' % (name, elapsed * 1000, longest * 1000, num_items, num_read))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""
+Generators of synthetic .dis files for benchmarking.
+
+Everything is generated from a seeded random.Random, so the same arguments always give the same lines.
+"""
+import os
+import random
+
+WORDS = ('alpha', 'bravo', 'charlie', 'delta', 'echo', 'foxtrot', 'golf', 'hotel', 'india', 'juliet', 'kilo',
+         'lima', 'mike', 'november', 'oscar', 'papa', 'quebec', 'romeo', 'sierra', 'tango')
+
+def _words(rng, count):
+    return ' '.join(rng.choice(WORDS) for _ in range(count))
+
+def outline(num_lines=100000, max_depth=12, seed=1):
+    """
+    Returns the lines of an outline: headings nested up to 'max_depth' deep, each followed by some body text and
+    list items. Some headings are TODO or DONE, and some have fold markers.
+    """
+    rng = random.Random(seed)
+    lines = []
+    depth = 1
+    while len(lines) < num_lines:
+        # Wander up and down, mostly a level at a time, with occasional jumps back towards the top.
+        step = rng.random()
+        if step < 0.4 and depth < max_depth:
+            depth += 1
+        elif step < 0.75 and depth > 1:
+            depth -= 1
+        elif step < 0.8:
+            depth = rng.randint(1, depth)
+
+        todo = rng.choice(('', '', '', 'TODO ', 'DONE '))
+        heading = '*' * depth + ' ' + todo + _words(rng, rng.randint(1, 6))
+        if rng.random() < 0.02:
+            heading += '{{{'
+        lines.append(heading)
+
+        for _ in range(rng.randint(0, 6)):
+            if rng.random() < 0.3:
+                lines.append(' ' * rng.randint(1, 4) + '- ' + _words(rng, rng.randint(1, 8)))
+            else:
+                lines.append(_words(rng, rng.randint(3, 12)))
+
+    return lines[:num_lines]
+
+def formula_table(num_rows=5000, seed=1):
+    """
+    Returns the lines of a table of 'num_rows' rows with chained formulae: each row's running total refers to the
+    one above, so changing the first row changes every total. Every 100th row also sums the 100 rows above it.
+    """
+    rng = random.Random(seed)
+    lines = ['| item | amount | running | subtotal |']
+    for row in range(1, num_rows):
+        amount = rng.randint(-1000, 1000)
+        if row == 1:
+            running = '=[@0 1]'
+        else:
+            running = '=[@-1 @0] + [@0 1]'
+
+        if row % 100 == 0:
+            subtotal = '=sum([@-99..@0 1])'
+        else:
+            subtotal = ''
+
+        lines.append('| %s | %d | %s | %s |' % (_words(rng, 2), amount, running, subtotal))
+
+    return lines
+
+def agenda_files(num_files=2000, lines_per_file=200, seed=1):
+    """
+    Returns the lines of 'num_files' outlines for the agenda, with a date on about one line in thirty.
+    """
+    rng = random.Random(seed)
+    files = []
+    for file_idx in range(num_files):
+        lines = outline(lines_per_file, seed=seed * 100003 + file_idx)
+        for row in range(len(lines)):
+            if rng.random() < 1 / 30:
+                lines[row] += ' <2025-%02d-%02d>' % (rng.randint(1, 12), rng.randint(1, 28))
+        files.append(lines)
+    return files
+
+def write_files(directory, files):
+    """
+    Write each of 'files' (lists of lines, as from agenda_files) to a .dis file under 'directory', spread over a few
+    subdirectories as notes usually are.
+    """
+    for file_idx, lines in enumerate(files):
+        subdirectory = os.path.join(directory, 'd%02d' % (file_idx % 20,))
+        os.makedirs(subdirectory, exist_ok=True)
+        with open(os.path.join(subdirectory, 'f%05d.dis' % (file_idx,)), 'w', encoding='utf-8') as f:
+            f.write('\n'.join(lines))
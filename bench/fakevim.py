@@ -0,0 +1,225 @@
+"""
+In-memory stand-in for Vim's 'vim' Python module, with just enough of it for the disorganiser commands to run.
+
+Install it as 'vim' before importing the plugin:
+
+    sys.modules['vim'] = fakevim
+
+Buffers are plain lists of lines. Folds follow the 'marker' method loosely: 'foldclose' closes the fold at the
+cursor, and any change to the buffer opens every fold again (the commands only close folds after writing markers).
+Text properties stay on their rows when lines are added or removed, rather than moving with their lines.
+"""
+import itertools
+import re
+
+_changedticks = itertools.count(1)
+
+class Buffer:
+    def __init__(self, lines, number):
+        self._lines = list(lines) or ['']
+        self.number = number
+        self.vars = {}
+        self.changedtick = next(_changedticks)
+        self.listeners = []  # functions called with (bufnr, changes) on listener_flush(), as with listener_add()
+        self._pending = []  # changes not yet passed to the listeners
+        self.folds_closed = set()  # rows (1-indexed) of closed folds
+        self.props = {}  # row (1-indexed) -> text properties on it, as dicts like prop_list() gives
+
+    def __len__(self):
+        return len(self._lines)
+
+    def __iter__(self):
+        return iter(list(self._lines))
+
+    def __getitem__(self, idx):
+        return self._lines[idx]
+
+    def __setitem__(self, idx, value):
+        if isinstance(idx, slice):
+            first, end, _step = idx.indices(len(self._lines))
+            end = max(first, end)
+            value = list(value)
+            self._lines[first:end] = value
+            self._changed(first, end, len(value) - (end - first))
+        else:
+            if idx < 0:
+                idx += len(self._lines)
+            self._lines[idx] = value
+            self._changed(idx, idx + 1, 0)
+
+    def __delitem__(self, idx):
+        if isinstance(idx, slice):
+            first, end, _step = idx.indices(len(self._lines))
+        else:
+            first, end = idx, idx + 1
+        del self._lines[first:end]
+        self._changed(first, end, first - end)
+
+    def append(self, lines, idx=None):
+        if isinstance(lines, str):
+            lines = [lines]
+        if idx is None:
+            idx = len(self._lines)
+        self._lines[idx:idx] = lines
+        self._changed(idx, idx, len(lines))
+
+    def _changed(self, first, end, added):
+        self.changedtick = next(_changedticks)
+        self.folds_closed.clear()
+        if self.listeners:
+            # As Vim passes them: 1-indexed, as strings (vim.eval converts numbers to strings).
+            self._pending.append({'lnum': str(first + 1), 'end': str(end + 1), 'added': str(added)})
+
+    def flush_listeners(self):
+        changes, self._pending = self._pending, []
+        if changes:
+            for listener in self.listeners:
+                listener(self.number, changes)
+
+class Window:
+    def __init__(self, buffer):
+        self.buffer = buffer
+        self.cursor = (1, 0)
+        self.height = 50
+
+    def view(self):
+        """
+        Returns the first and last rows (1-indexed) shown: the window scrolls to keep the cursor in the middle.
+        """
+        top = max(1, min(self.cursor[0] - self.height // 2, len(self.buffer) - self.height + 1))
+        return top, min(top + self.height - 1, len(self.buffer))
+
+class Current:
+    def __init__(self):
+        self.buffer = None
+        self.window = None
+
+    @property
+    def line(self):
+        return self.buffer[self.window.cursor[0] - 1]
+
+    @line.setter
+    def line(self, value):
+        self.buffer[self.window.cursor[0] - 1] = value
+
+class Buffers:
+    def __init__(self):
+        self._buffers = {}
+
+    def __getitem__(self, number):
+        return self._buffers[number]
+
+    def __iter__(self):
+        return iter(self._buffers.values())
+
+    def add(self, lines):
+        buffer = Buffer(lines, len(self._buffers) + 1)
+        self._buffers[buffer.number] = buffer
+        return buffer
+
+current = Current()
+buffers = Buffers()
+vars = {'&foldmethod': 'marker'}  # Vim variables and options visible to exists() and eval()
+commands = []  # every Ex command run, in order
+visual = (1, 1)  # first and last rows of the last visual selection
+prop_types = {}  # text property type name -> its properties, as given to prop_type_add()
+
+def new_buffer(lines):
+    """
+    Create a buffer holding 'lines' and make it current, with the cursor at the top.
+    """
+    buffer = buffers.add(lines)
+    switch_to(buffer)
+    return buffer
+
+def switch_to(buffer):
+    current.buffer = buffer
+    current.window = Window(buffer)
+
+def command(cmd):
+    commands.append(cmd)
+    if cmd == 'foldclose':
+        current.buffer.folds_closed.add(current.window.cursor[0])
+    elif cmd == 'foldopen':
+        current.buffer.folds_closed.discard(current.window.cursor[0])
+
+def _prop_add(lnum, col, props):
+    end_col = props['end_col'] if 'end_col' in props else col + props.get('length', 0)
+    if props.get('end_lnum', lnum) != lnum:
+        raise NotImplementedError("fakevim can't add text properties across lines")
+    current.buffer.props.setdefault(lnum, []).append(
+        {'col': col, 'length': end_col - col, 'type': props['type'], 'id': props.get('id', 0)})
+
+def _prop_add_list(props, positions):
+    for lnum, col, end_lnum, end_col in positions:
+        _prop_add(lnum, col, dict(props, end_lnum=end_lnum, end_col=end_col))
+
+def _prop_remove(props, lnum=None, lnum_end=None):
+    if lnum is None:
+        rows = list(current.buffer.props)
+    else:
+        rows = range(lnum, (lnum if lnum_end is None else lnum_end) + 1)
+    removed = 0
+    for row in rows:
+        if row in current.buffer.props:
+            kept = [prop for prop in current.buffer.props[row]
+                    if any(prop[key] != props[key] for key in ('id', 'type') if key in props)]
+            removed += len(current.buffer.props[row]) - len(kept)
+            current.buffer.props[row] = kept
+    return removed
+
+_FUNCTIONS = {
+    'prop_type_get': lambda name: dict(prop_types.get(name, {})),
+    'prop_type_add': prop_types.__setitem__,
+    'prop_add': _prop_add,
+    'prop_add_list': _prop_add_list,
+    'prop_remove': _prop_remove,
+}
+
+def Function(name):
+    """
+    A Vim function, callable from Python. Only the text property functions are here.
+    """
+    if name not in _FUNCTIONS:
+        raise NotImplementedError("fakevim doesn't have %s()" % (name,))
+    return _FUNCTIONS[name]
+
+_FOLDCLOSED = re.compile(r'foldclosed\((\d+)\)')
+_GETPOS = re.compile(r'''getpos\("'([<>])"\)''')
+_GETBUFVAR = re.compile(r'getbufvar\((\d+), "changedtick"\)')
+_EXISTS = re.compile(r'exists\("(.*)"\)')
+
+def eval(expr):
+    match = _FOLDCLOSED.fullmatch(expr)
+    if match:
+        row = int(match.group(1))
+        return str(row) if row in current.buffer.folds_closed else '-1'
+
+    match = _GETPOS.fullmatch(expr)
+    if match:
+        row = visual[0] if match.group(1) == '<' else visual[1]
+        return ['0', str(row), '1', '0']
+
+    if expr == 'b:changedtick':
+        return str(current.buffer.changedtick)
+
+    if expr == '[b:changedtick, line("w0"), line("w$")]':
+        return [str(current.buffer.changedtick)] + [str(row) for row in current.window.view()]
+
+    match = _GETBUFVAR.fullmatch(expr)
+    if match:
+        return str(buffers[int(match.group(1))].changedtick)
+
+    match = _EXISTS.fullmatch(expr)
+    if match:
+        name = match.group(1)
+        return '1' if name in vars or (name.startswith('*') and name[1:] in _FUNCTIONS) else '0'
+
+    if expr == 'listener_flush()':
+        current.buffer.flush_listeners()
+        return '0'
+
+    if expr in vars:
+        return vars[expr]
+
+    raise NotImplementedError('fakevim can\'t evaluate %r' % (expr,))
@@ -0,0 +1,191 @@
+"""
+Compare the formula parsers (see PARSERS below): check that they agree, then time them.
+
+    python3 bench/parsers.py [-n CASES] [--seed SEED]
+
+Cells are generated at random from the formula grammar, plus mutated copies of them (with characters inserted,
+deleted or swapped), so that both valid and invalid cells are tried. Every parser must give the same AST as the
+parsy grammar, or raise ParseError when it does. Exits with status 1 if they disagree.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(BENCH_DIR), 'plugin'))
+
+from disexpr import FORMULA_PARSERS, ParseError
+
+# The parsers to compare: every choice of g:disorganiser_formula_parser.
+PARSERS = dict(FORMULA_PARSERS)
+
+# Formulae as they appear in real tables.
+REALISTIC = [
+    '=2 + 2',
+    '=[@-1 @0] + [@0 1]',
+    '=sum([1..@-1 @0])',
+    '=sum([1..before this])',
+    '=avg([costs: 1..3 2])',
+    '=[0 0] * 2',
+    '=[l1] * 1.15',
+    '=([@0 1] - [@0 2]) / [@0 2] * 100',
+    '=max([1..before this]) - min([1..before this])',
+    '=sqrt([u1] * [u1] + [l1] * [l1])',
+    '=count([0..@-1 2]) + sum([0..@-1 3], [0..@-1 4])',
+    '="total"',
+]
+
+# Corners of the grammar which a parser could easily get wrong.
+QUIRKS = [
+    '', '  ', '0', '-0', '1.', '-1.50', '1..2', '1.2.3', '2x', '- 1', '1 -2', '1--2', '2*-3', '1 - - 2', '+1',
+    'f(0)', 'f(1, 0)', 'f(0, 1)', 'f("")', 'f(0.0)', 'f((0))', 'f()', 'f(1,)', 'f(,)', 'f(1 2)', 'f(1 +)', 'f (1)',
+    'pi', 'pi(', '()', '(1)(2)', '"a"b', '"unterminated', 'a b', '1 +', '1 2',
+    '[this ]', '[0 this ]', '[0 this]', '[this1]', '[thisthis]', '[this 1 ]', '[ 1 2 ]', '[11]', '[1 .. 3 0]',
+    '[1.. 3 0]', '[1 ..3 0]', '[this .. after 0]', '[@ 1 0]', '[@1@2]', '[-1 0]', '[1.5 2]', '[l1]', '[l 1]',
+    '[l-1]', '[ d1 ]', '[u1 ]', '[l1 1]', '[after 1]', '[before1]', '[1 before..after]',
+    '[costs: 1 2]', '[costs:1 2]', '[costs :1 2]', '[this: 1 2]', '[l: 1 2]', '[this: l1]', '[l:x]', '[costs: l1]',
+    '[1 2]abc', '[1 2] [1 2]', 'sum([0..3 0..1])',
+]
+
+SPACES = ['', '', '', ' ', '  ', '\t']
+CHARS = ' \t-+*/()[]@.:,"0123456789abdlrtu_'
+
+def _space(rng):
+    return rng.choice(SPACES)
+
+def _ref_part(rng):
+    single = rng.choice([
+        lambda: '@%d' % rng.randint(-3, 3),
+        lambda: str(rng.randint(-2, 12)),
+        lambda: rng.choice(['before', 'after', 'this']),
+    ])
+    if rng.random() < 0.3:
+        return single() + _space(rng) + '..' + _space(rng) + rng.choice(['@1', 'this', '3', 'before'])
+    return single()
+
+def _ref(rng):
+    kind = rng.random()
+    if kind < 0.15:
+        body = rng.choice('lrud') + _space(rng) + str(rng.randint(-2, 9))
+    else:
+        body = _ref_part(rng) + rng.choice(SPACES + [' ']) + _ref_part(rng)
+        if kind > 0.85:
+            body = rng.choice(['costs', 'this', 'l', 't1']) + ':' + _space(rng) + body
+    return '[' + _space(rng) + body + _space(rng) + ']'
+
+def _operand(rng, depth):
+    kind = rng.random()
+    if depth > 3 or kind < 0.25:
+        return rng.choice([
+            lambda: str(rng.randint(-20, 200)),
+            lambda: '%d.%s' % (rng.randint(-5, 50), rng.choice(['', '0', '5', '25'])),
+            lambda: '"%s"' % rng.choice(['', 'x', 'a b']),
+            lambda: rng.choice(['pi', 'x', 'before', 'l1', '_a2']),
+        ])()
+    elif kind < 0.6:
+        return _ref(rng)
+    elif kind < 0.8:
+        args = [_expr(rng, depth + 1) for _ in range(rng.randint(0, 3))]
+        if args and rng.random() < 0.2:
+            args.append('')  # trailing comma
+        return rng.choice(['sum', 'avg', 'f', 'sin']) + _space(rng) + '(' + _space(rng) + \
+            (',' + _space(rng)).join(args) + ')'
+    else:
+        return '(' + _space(rng) + _expr(rng, depth + 1) + ')'
+
+def _expr(rng, depth=0):
+    expr = _operand(rng, depth)
+    for _ in range(rng.randint(0, 3 if depth < 3 else 0)):
+        expr += _space(rng) + rng.choice('+-*/') + _space(rng) + _operand(rng, depth + 1)
+    return expr + _space(rng)
+
+def _mutate(rng, text):
+    text = list(text)
+    for _ in range(rng.randint(1, 3)):
+        action = rng.random()
+        index = rng.randint(0, len(text))
+        if action < 0.4 or not text:
+            text.insert(index, rng.choice(CHARS))
+        elif action < 0.8:
+            del text[min(index, len(text) - 1)]
+        else:
+            other = rng.randrange(len(text))
+            index = min(index, len(text) - 1)
+            text[index], text[other] = text[other], text[index]
+    return ''.join(text)
+
+def cases(count, seed):
+    rng = random.Random(seed)
+    result = REALISTIC + QUIRKS
+    while len(result) < count:
+        text = _space(rng) + _expr(rng)
+        result.append(text)
+        result.append(_mutate(rng, text))
+    return result
+
+def _outcome(parse, text):
+    try:
+        return repr(parse(text))  # (repr, so that e.g. 1 and Decimal('1') differ)
+    except ParseError:
+        return 'ParseError'
+
+def compare(texts):
+    """
+    Returns the cells on which a parser disagrees with the parsy grammar, as (parser name, text, expected, got).
+    """
+    reference = PARSERS['parsy']
+    disagreements = []
+    for text in texts:
+        expected = _outcome(reference, text)
+        for name, parse in PARSERS.items():
+            if parse is not reference:
+                got = _outcome(parse, text)
+                if got != expected:
+                    disagreements.append((name, text, expected, got))
+    return disagreements
+
+def time_parser(parse, texts, repeat=3):
+    """
+    Returns the best time, over 'repeat' tries, taken to parse each of 'texts' once, in seconds.
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for text in texts:
+            try:
+                parse(text)
+            except ParseError:
+                pass
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Check that the formula parsers agree, and time them.')
+    parser.add_argument('-n', '--cases', type=int, default=20000, help='number of cells to try (default 20000)')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args(argv)
+
+    # Parse the formulae without the leading '=', as recalculation does.
+    texts = [text[1:] if text.startswith('=') else text for text in cases(args.cases, args.seed)]
+    realistic = [text[1:] for text in REALISTIC]
+
+    disagreements = compare(texts)
+    for name, text, expected, got in disagreements[:20]:
+        print('%s: %r: parsy gives %s, %s gives %s' % (name, text, expected, name, got))
+    valid = sum(1 for text in texts if _outcome(PARSERS['parsy'], text) != 'ParseError')
+    print('%d cells (%d valid), %d disagreements' % (len(texts), valid, len(disagreements)))
+
+    print('%-10s %16s %16s' % ('parser', 'realistic us', 'random us'))
+    for name, parse in PARSERS.items():
+        print('%-10s %16.2f %16.2f' % (
+            name,
+            time_parser(parse, realistic * 100) * 1e6 / (len(realistic) * 100),
+            time_parser(parse, texts) * 1e6 / len(texts)))
+
+    return 1 if disagreements else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,100 @@
+"""
+Check that recalculating tables gives the expected results.
+
+    python3 bench/recalc.py
+
+Each case is a list of lines, recalculated with discalc.recalc_lines, and the values the formulae should come to.
+The file cases are the contents of a file, rewritten by the command-line tool (see discli), and what it should
+contain afterwards. Exits with status 1 if any differ.
+"""
+import os
+import sys
+import tempfile
+
+BENCH_DIR = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(BENCH_DIR), 'plugin'))
+
+from discalc import TABLE_CELL_FORMULA, recalc_lines
+from discli import process_file
+
+OTHER = ['#other', '| 1 |', '| 2 |', '| x |', '']
+
+# (lines, the value shown by each formula, in order)
+CASES = [
+    (['| 1 |', '| 2 |', '| =sum([0..1 0]) |'], ['3']),
+    (['| 1 |', '| 2.5 |', '| |', '| =sum([0..2 0]) |', '| =avg([0..2 0]) |'], ['3.5', '1.75']),
+    (['| 1 | 2 |', '| =[0 0] + [0 1] | =[@-1 0] * 2 |'], ['3', '2']),
+    # References to another table skip its text, and cells beyond its end, as avg, max and count do.
+    (OTHER + ['| =sum([other: 0..2 0]) |'], ['3']),
+    (OTHER + ['| =sum([other: 0..5 0]) |'], ['3']),
+    (OTHER + ['| =sum([other: 0..1 3]) |'], ['0']),
+    (OTHER + ['| =avg([other: 0..2 0]) | =max([other: 0..2 0]) | =count([other: 0..2 0]) |'], ['1.5', '2', '2']),
+    (OTHER + ['| =sum([other: 0..2 0], 10) |'], ['13']),
+    (['| =[missing: 0 0] |'], ['?NOTABLE']),
+    # Bad references give an error value, rather than stopping the recalculation.
+    (['| =[@-1 0] | =[9 9] |', '| 1 | =[1 0] + 1 |'], ['?NOCELL', '?NOCELL', '2']),
+    (['| a | =[0 0] |', '| 2 | =[1 0] * 2 |'], ["?EXC'a'", '4']),
+    # Tables further down see the new values of named tables above them.
+    (['#a', '| 1 | =[0 0] * 2 |', '', '| =[a: 0 1] + 1 |', '', '#b', '| =[a: 0 1] * 10 |', '', '| =[b: 0 0] |'],
+     ['2', '3', '20', '20']),
+]
+
+# (file contents, file contents after processing)
+FILE_CASES = [
+    ('x\n| 5 | b |\n| 1 | =[0 0]+1 |\nend\n', 'x\n| 5| b        |\n| 1|=[0 0]+1=6|\nend\n'),
+    # Lines keep their own line endings.
+    ('x\r\n| 5 | b |\r\n| 1 | =[0 0]+1 |\r\nend\r\n', 'x\r\n| 5| b        |\r\n| 1|=[0 0]+1=6|\r\nend\r\n'),
+    ('x\n| 5 | b |\r\n| 1 | =[0 0]+1 |\nend', 'x\n| 5| b        |\r\n| 1|=[0 0]+1=6|\nend'),
+]
+
+def _results(lines):
+    results = []
+    for line in lines:
+        for cell in line.split('|')[1:]:
+            match = TABLE_CELL_FORMULA.match(cell)
+            if match:
+                results.append(cell[match.end() + 1:].strip())
+    return results
+
+def check(cases):
+    """
+    Returns the cases which don't recalculate as expected, as (lines, expected, got).
+    """
+    failures = []
+    for lines, expected in cases:
+        got_lines = list(lines)
+        try:
+            recalc_lines(got_lines)
+            got = _results(got_lines)
+        except Exception as e:
+            got = repr(e)
+        if got != expected:
+            failures.append((lines, expected, got))
+    return failures
+
+def check_files(cases):
+    """
+    Returns the file cases which aren't rewritten as expected, as (contents, expected, got).
+    """
+    failures = []
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = os.path.join(temp_dir, 'case.dis')
+        for text, expected in cases:
+            with open(path, 'w', encoding='utf-8', newline='') as f:
+                f.write(text)
+            _path, _changed, _messages, error = process_file(path)
+            with open(path, encoding='utf-8', newline='') as f:
+                got = f.read() if error is None else error
+            if got != expected:
+                failures.append((text, expected, got))
+    return failures
+
+def main():
+    failures = check(CASES) + check_files(FILE_CASES)
+    for lines, expected, got in failures:
+        print('%r: expected %r, got %r' % (lines, expected, got))
+    print('%d cases, %d failures' % (len(CASES) + len(FILE_CASES), len(failures)))
+    return 1 if failures else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,224 @@
+"""
+Time the disorganiser commands on large synthetic files, without Vim.
+
+    python3 bench/run.py [-n ITERATIONS] [-k PATTERN] [--outline-lines N] [--table-rows N] [--incremental-outline]
+
+Each benchmark runs one command repeatedly on one buffer, with the cursor on a randomly chosen suitable line each
+time, and reports the latency percentiles. Edits made by a command are kept, so later runs see the buffer as it was
+left, much as when editing. Anything done to set up a run (such as editing a cell, or emptying the caches for the
+"cold" benchmarks) isn't timed.
+"""
+import argparse
+import os
+import random
+import re
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(BENCH_DIR), 'plugin'))
+sys.path.insert(0, BENCH_DIR)
+
+import fakevim
+sys.modules['vim'] = fakevim
+
+import corpus
+import disexpr
+import discalc
+import distable
+import dishighlight
+import disorganiser
+
+def _is_heading(line):
+    return line.startswith('*')
+
+def _is_list(line):
+    return disorganiser.RE_UL.match(line) is not None
+
+def _is_table(line):
+    return discalc.TABLE_LINE_RE.match(line) is not None
+
+def _anything(line):
+    return True
+
+def _edit_amount(rng, buffer, row_idx):
+    """
+    Change the amount in a random row of the formula table (which changes every running total below it).
+    """
+    edit_idx = rng.randrange(1, len(buffer))
+    cells = buffer[edit_idx].split('|')
+    if len(cells) > 2:
+        cells[2] = ' %d ' % (rng.randint(-1000, 1000),)
+        buffer[edit_idx] = '|'.join(cells)
+
+def _clear_table_caches(rng, buffer, row_idx):
+    distable._tables.clear()
+    distable._recalc_states.clear()
+    distable._named_table_indexes.clear()
+    discalc.FORMULA_CACHE.clear()
+    disexpr.CELL_CACHE.clear()
+
+def _clear_outline_caches(rng, buffer, row_idx):
+    disorganiser._outline_indexes.clear()
+
+def _clear_highlight_caches(rng, buffer, row_idx):
+    disorganiser._highlight_states.clear()
+    dishighlight.tokenize_line.cache_clear()
+    buffer.props.clear()
+
+def _select_subtree(rng, buffer, row_idx):
+    fakevim.visual = (row_idx + 1, min(row_idx + rng.randint(1, 20), len(buffer)))
+
+def _recalc():
+    distable._recalc(distable._read_table())
+
+def _reformat():
+    distable._reformat(distable._read_table())
+
+class Benchmark:
+    """
+    name: shown in the report
+    corpus: 'outline' or 'table' -- which buffer to run in
+    suitable(line): True if the command can be run with the cursor on this line
+    command(): the command
+    before(rng, buffer, row_idx): if given, called before each run, untimed
+    share: fraction of the iterations to run (for slow benchmarks)
+    """
+    def __init__(self, name, corpus, suitable, command, before=None, share=1.0):
+        self.name = name
+        self.corpus = corpus
+        self.suitable = suitable
+        self.command = command
+        self.before = before
+        self.share = share
+
+BENCHMARKS = [
+    Benchmark('dis_tab (heading)', 'outline', _is_heading, disorganiser.dis_tab),
+    Benchmark('dis_fold_cycle', 'outline', _is_heading, disorganiser.dis_fold_cycle),
+    Benchmark('dis_fold_cycle (cold)', 'outline', _is_heading, disorganiser.dis_fold_cycle, _clear_outline_caches),
+    Benchmark('dis_fold_levels', 'outline', _anything, disorganiser.dis_fold_levels, _clear_outline_caches),
+    Benchmark('dis_highlight (jump)', 'outline', _anything, disorganiser.dis_highlight),
+    Benchmark('dis_highlight (cold)', 'outline', _anything, disorganiser.dis_highlight, _clear_highlight_caches),
+    Benchmark('dis_indent', 'outline', _is_heading, disorganiser.dis_indent),
+    Benchmark('dis_dedent', 'outline', _is_heading, disorganiser.dis_dedent),
+    Benchmark('dis_indent_visual', 'outline', _anything, disorganiser.dis_indent_visual, _select_subtree),
+    Benchmark('dis_dedent_visual', 'outline', _anything, disorganiser.dis_dedent_visual, _select_subtree),
+    Benchmark('dis_indent_subtree', 'outline', _is_heading, disorganiser.dis_indent_subtree),
+    Benchmark('dis_dedent_subtree', 'outline', _is_heading, disorganiser.dis_dedent_subtree),
+    Benchmark('dis_cr (outline)', 'outline', _is_heading, disorganiser.dis_cr),
+    Benchmark('dis_outline_insert_above_children', 'outline', _is_heading,
+              disorganiser.dis_outline_insert_above_children),
+    Benchmark('dis_outline_insert_after_children', 'outline', _is_heading,
+              disorganiser.dis_outline_insert_after_children),
+    Benchmark('dis_outline_insert_above_current', 'outline', _is_heading,
+              disorganiser.dis_outline_insert_above_current),
+    Benchmark('dis_list_insert_above_children', 'outline', _is_list, disorganiser.dis_list_insert_above_children),
+    Benchmark('dis_cycle_todo', 'outline', _anything, disorganiser.dis_cycle_todo),
+    Benchmark('dis_date_insert', 'outline', _anything, disorganiser.dis_date_insert),
+    Benchmark('dis_tab (table)', 'table', _is_table, disorganiser.dis_tab),
+    Benchmark('dis_itab', 'table', _is_table, disorganiser.dis_itab),
+    Benchmark('dis_cr (table)', 'table', _is_table, disorganiser.dis_cr),
+    Benchmark('dis_table_reformat', 'table', _is_table, disorganiser.dis_table_reformat),
+    Benchmark('dis_table_reformat (one cell edited)', 'table', _is_table, disorganiser.dis_table_reformat,
+              _edit_amount),
+    Benchmark('dis_table_reformat (cold)', 'table', _is_table, disorganiser.dis_table_reformat,
+              _clear_table_caches, share=0.1),
+    Benchmark('dis_cycle_todo_or_reformat_table', 'table', _is_table,
+              disorganiser.dis_cycle_todo_or_reformat_table, _edit_amount),
+    Benchmark('dis_make_table_visual', 'table', _is_table, disorganiser.dis_make_table_visual, _select_subtree),
+    Benchmark('_recalc (cold)', 'table', _is_table, _recalc, _clear_table_caches, share=0.1),
+    Benchmark('_reformat', 'table', _is_table, _reformat, _edit_amount),
+]
+
+def percentile(sorted_samples, pct):
+    """
+    Nearest-rank percentile of a sorted, non-empty list.
+    """
+    rank = max(1, -(-len(sorted_samples) * pct // 100))
+    return sorted_samples[int(rank) - 1]
+
+def _pick_row(rng, buffer, suitable, rows):
+    """
+    Pick a random row whose line is suitable. 'rows' is a list of the suitable rows when the buffer was created,
+    which is looked at first as commands don't usually move many lines.
+    """
+    for _ in range(20):
+        row_idx = rng.choice(rows)
+        if row_idx < len(buffer) and suitable(buffer[row_idx]):
+            return row_idx
+
+    rows[:] = [row_idx for row_idx, line in enumerate(buffer) if suitable(line)]
+    return rng.choice(rows)
+
+def run_benchmark(benchmark, lines, iterations, seed, incremental_outline=False):
+    """
+    Run 'benchmark' on a new buffer holding 'lines', and return the time taken by each run, in seconds.
+    """
+    rng = random.Random(seed)
+    buffer = fakevim.new_buffer(lines)
+    if incremental_outline:
+        buffer.vars['disorganiser_listener'] = 1
+        buffer.listeners.append(disorganiser.dis_outline_listener)
+
+    rows = [row_idx for row_idx, line in enumerate(lines) if benchmark.suitable(line)]
+    if not rows:
+        return []
+
+    samples = []
+    for _ in range(max(1, int(iterations * benchmark.share))):
+        row_idx = _pick_row(rng, buffer, benchmark.suitable, rows)
+        line = buffer[row_idx]
+        fakevim.current.window.cursor = (row_idx + 1, rng.randint(0, max(len(line) - 1, 0)))
+        if benchmark.before is not None:
+            benchmark.before(rng, buffer, row_idx)
+        del fakevim.commands[:]
+
+        start = time.perf_counter()
+        benchmark.command()
+        samples.append(time.perf_counter() - start)
+
+    return samples
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Time the disorganiser commands on large synthetic files.')
+    parser.add_argument('-n', '--iterations', type=int, default=100, help='runs of each command (default 100)')
+    parser.add_argument('-k', '--filter', metavar='PATTERN', help='only run benchmarks whose name matches PATTERN')
+    parser.add_argument('--outline-lines', type=int, default=100000, help='lines in the outline (default 100000)')
+    parser.add_argument('--table-rows', type=int, default=5000, help='rows in the formula table (default 5000)')
+    parser.add_argument('--incremental-outline', action='store_true',
+                        help='keep the outline index up to date with change listeners, as with '
+                             'g:disorganiser_incremental_outline')
+    parser.add_argument('--fold-expr', action='store_true',
+                        help="fold as with g:disorganiser_fold_mode 'expr' rather than with markers")
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args(argv)
+
+    if args.fold_expr:
+        fakevim.vars['&foldmethod'] = 'expr'
+
+    corpora = {
+        'outline': corpus.outline(args.outline_lines, seed=args.seed),
+        'table': corpus.formula_table(args.table_rows, seed=args.seed),
+    }
+
+    benchmarks = BENCHMARKS
+    if args.filter:
+        benchmarks = [benchmark for benchmark in benchmarks if re.search(args.filter, benchmark.name)]
+
+    print('%d-line outline, %d-row table; times in milliseconds' % (args.outline_lines, args.table_rows))
+    print('%-40s %5s %9s %9s %9s %9s %9s' % ('command', 'runs', 'mean', 'p50', 'p90', 'p99', 'max'))
+    for benchmark in benchmarks:
+        samples = run_benchmark(benchmark, corpora[benchmark.corpus], args.iterations, args.seed,
+                                args.incremental_outline)
+        if not samples:
+            print('%-40s (nowhere to run it)' % (benchmark.name,))
+            continue
+
+        samples = sorted(sample * 1000 for sample in samples)
+        print('%-40s %5d %9.3f %9.3f %9.3f %9.3f %9.3f' % (
+            benchmark.name, len(samples), sum(samples) / len(samples),
+            percentile(samples, 50), percentile(samples, 90), percentile(samples, 99), samples[-1]))
+        sys.stdout.flush()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+"""
+Time :DisSearch on a directory of generated files: searching the index of headings (which is all the command waits
+for), checking the files for changes (which a timer does afterwards), and updating the index when a file is written.
+
+    python3 bench/search.py [-n QUERIES] [--files N] [--lines N]
+
+The files and the cache are made in a temporary directory, which is removed afterwards.
+"""
+import argparse
+import contextlib
+import os
+import random
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(BENCH_DIR), 'plugin'))
+sys.path.insert(0, BENCH_DIR)
+
+import corpus
+from dissearch import search_headings
+from disscan import ScanCache, find_files, parse_file
+from run import percentile
+
+def _query(rng):
+    words = [rng.choice(corpus.WORDS) for _ in range(rng.randint(1, 3))]
+    if rng.random() < 0.5:
+        words[-1] = words[-1][:rng.randint(1, len(words[-1]))]  # (still being typed)
+    return ' '.join(words)
+
+def _report(name, samples):
+    samples = sorted(sample * 1000 for sample in samples)
+    print('%-20s %5d %9.3f %9.3f %9.3f %9.3f' % (name, len(samples), sum(samples) / len(samples),
+                                                   percentile(samples, 50), percentile(samples, 90), samples[-1]))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Time the heading search.')
+    parser.add_argument('-n', '--queries', type=int, default=200, help='number of searches (default 200)')
+    parser.add_argument('--files', type=int, default=2000, help='number of files (default 2000)')
+    parser.add_argument('--lines', type=int, default=200, help='lines in each file (default 200)')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args(argv)
+    rng = random.Random(args.seed)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        directory = os.path.join(temp_dir, 'notes')
+        cache_path = os.path.join(temp_dir, 'cache', 'scan.sqlite3')
+        corpus.write_files(directory, corpus.agenda_files(args.files, args.lines, args.seed))
+        paths = sorted(find_files(directory))
+
+        with contextlib.closing(ScanCache(cache_path)) as cache:
+            cache.scan(directory)
+            num_words = cache.db.execute('SELECT count(*) FROM word_headings').fetchone()[0]
+            print('%d files of %d lines, %d indexed words, %d bytes of cache; times in milliseconds' % (
+                args.files, args.lines, num_words, os.path.getsize(cache_path)))
+            print('%-20s %5s %9s %9s %9s %9s' % ('', 'runs', 'mean', 'p50', 'p90', 'max'))
+
+            samples = []
+            for _ in range(10):
+                start = time.perf_counter()
+                cache.changes(directory)
+                samples.append(time.perf_counter() - start)
+            _report('check for changes', samples)
+
+            samples = []
+            for _ in range(args.queries):
+                query = _query(rng)
+                start = time.perf_counter()
+                search_headings(cache, query, directory)
+                samples.append(time.perf_counter() - start)
+            _report('search', samples)
+
+            samples = []
+            for path in rng.sample(paths, min(50, len(paths))):
+                with open(path, 'a', encoding='utf-8') as f:
+                    f.write('\n* TODO written %s' % (_query(rng),))
+                start = time.perf_counter()
+                cache.update([parse_file(path)])
+                samples.append(time.perf_counter() - start)
+            _report('update on write', samples)
+
+if __name__ == '__main__':
+    main()
@@ -1,3 +1,6 @@
+" Load the Python side, the first time a disorganiser buffer is opened.
+call disorganiser#load()
+
 " Key mappings specific to .org files
 
 noremap <buffer> << :python3 dis_dedent()<CR>
@@ -30,5 +33,10 @@ if (exists('g:rainbow_active') && g:rainbow_active)
 	auto syntax disorganiser call rainbow#clear()
 endif
 
-" Disorganiser uses {{{ and }}} to indicate folds, i.e. Vim's marker method.
-setlocal foldmethod=marker
+if get(g:, 'disorganiser_fold_mode', 'marker') ==# 'expr'
+	" Fold on the headings, without writing markers into the file.
+	setlocal foldmethod=expr foldexpr=disorganiser#foldexpr(v:lnum)
+else
+	" Disorganiser uses {{{ and }}} to indicate folds, i.e. Vim's marker method.
+	setlocal foldmethod=marker
+endif
@@ -0,0 +1,19 @@
+"""
+The agenda: the TODO headings and dated lines in a directory of disorganiser files, in date order.
+
+The files are read by disscan, which keeps what it found in its cache, so that a file is only read again once it has
+changed.
+
+This module doesn't use Vim.
+"""
+from disscan import under
+
+def agenda_items(cache, directory):
+    """
+    Returns the TODO headings and dated lines of the files under 'directory', as (date, path, row, state, text), in
+    date order with the undated ones last. 'cache' is a disscan.ScanCache.
+    """
+    condition, params = under(directory)
+    return cache.db.execute('SELECT date, path, row, state, text FROM records JOIN files ON files.id = records.file '
+                            "WHERE (state = 'TODO' OR date IS NOT NULL) AND " + condition +
+                            ' ORDER BY date IS NULL, date, path, row', params).fetchall()
@@ -0,0 +1,934 @@
+"""
+Tables and their formulae: reading, recalculating and aligning tables in lists of lines.
+
+This module doesn't use Vim (see distable for the Vim commands), so that tables can also be recalculated outside
+Vim (see discli).
+"""
+import re
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import deque
+
+from disexpr import parse_cell, parse_literal, dis_eval, dis_compile, DEFAULT_CONTEXT, ParseCache, ParseError, \
+    NOT_A_LITERAL
+from dislines import changed_span, replace_lines
+from disrange import LineAggregate, NUMBER_TYPES, UNAVAILABLE
+
+TABLE_LINE_RE = re.compile(r'^[ \t]*\|')
+TABLE_BAR_END = re.compile(r'.*\|[ \t]*$')
+TABLE_CELL_FORMULA = re.compile(r'[ \t]*=([^|=]+)')
+TABLE_NAME_RE = re.compile(r'^[ \t]*#([A-Za-z_][A-Za-z0-9_]*)[ \t]*$')
+
+# Table cell matcher also matches pre-table space. Cells start with their bar.
+# So "   | cell 1 | whatever" becomes, with .findall, ['   ', '| cell 1 ', '| whatever']
+TABLE_CELLS = re.compile(r'(^[^|]*|\|[^|]*)') 
+
+class Table:
+    """
+    The cells of a table, stored by column. In Vim, a table is read once per command and shared by everything
+    the command does.
+
+    Column 0 is the text to the left of the table (the indentation); the other columns hold the text of each
+    cell without its bar or trailing whitespace. Rows may have different numbers of cells; missing cells are
+    stored as ''.
+
+    A Table can be kept along with the lines it was rendered to, so that after an edit only the rows which
+    changed are read again (see update), and only rows which changed (or all of them, if a column width
+    changed) are rendered again.
+    """
+    __slots__ = ('first_line_idx', 'lines', 'columns', 'row_lengths', 'aligned', '_widths', '_dirty',
+                 '_rendered_widths')
+
+    def __init__(self, lines, first_line_idx=0):
+        self.first_line_idx = first_line_idx  # buffer index of the first line of the table
+        self.lines = lines  # the table as it is in the buffer
+        self.columns = []
+        self.row_lengths = array('l')
+        self.aligned = False  # whether cells are padded to the width of their column when rendered
+        self._widths = None
+        self._dirty = set()  # rows which need rendering again
+        self._rendered_widths = None  # the widths the (aligned) lines were rendered with
+
+        self._splice_rows(0, 0, lines)
+
+    def __len__(self):
+        return len(self.row_lengths)
+
+    def _splice_rows(self, start, end, lines):
+        """
+        Replace rows start to end - 1 with the cells of 'lines'.
+        """
+        rows = []
+        for line in lines:
+            cells = TABLE_CELLS.findall(line)
+            # The first column is pre-table padding. All other columns should be stripped.
+            rows.append([cells[0]] + [cell[1:].rstrip() for cell in cells[1:]])
+
+        num_columns = max(map(len, rows), default=0)
+        for _ in range(len(self.columns), num_columns):
+            self.columns.append([''] * len(self))
+            if self._widths is not None:
+                self._widths.append(0)
+
+        for col_idx, column in enumerate(self.columns):
+            removed = column[start:end]
+            added = [row[col_idx] if col_idx < len(row) else '' for row in rows]
+            column[start:end] = added
+
+            if self._widths is not None:
+                width = self._widths[col_idx]
+                added_width = max(map(len, added), default=0)
+                if added_width >= width:
+                    self._widths[col_idx] = added_width
+                elif any(len(cell) == width for cell in removed):
+                    self._widths[col_idx] = max(map(len, column))
+
+        self.row_lengths[start:end] = array('l', map(len, rows))
+
+        # Drop columns which no row has any more.
+        num_columns = max(self.row_lengths, default=0)
+        if num_columns < len(self.columns):
+            del self.columns[num_columns:]
+            if self._widths is not None:
+                del self._widths[num_columns:]
+
+    def update(self, lines):
+        """
+        Bring the table up to date with 'lines', the table as it is now in the buffer, reading only the rows
+        which changed. Those rows are rendered again (see render).
+        """
+        start, end_old, end_new = changed_span(self.lines, lines)
+        if start == end_old == end_new:
+            return
+
+        self._splice_rows(start, end_old, lines[start:end_new])
+        self.lines = lines
+        self._dirty.update(range(start, end_new))
+
+    def row(self, row_idx):
+        """
+        Returns the cells of a row, starting with the text to the left of the table.
+        """
+        return [column[row_idx] for column in self.columns[:self.row_lengths[row_idx]]]
+
+    def set_cell(self, row_idx, col_idx, text):
+        old_text = self.columns[col_idx][row_idx]
+        self.columns[col_idx][row_idx] = text
+        self._dirty.add(row_idx)
+
+        if self._widths is not None:
+            if len(text) >= self._widths[col_idx]:
+                self._widths[col_idx] = len(text)
+            elif len(old_text) == self._widths[col_idx]:
+                self._widths = None
+
+    @property
+    def widths(self):
+        """
+        The width of each column, starting with the text to the left of the table.
+        """
+        if self._widths is None:
+            self._widths = [max(map(len, column)) for column in self.columns]
+        return self._widths
+
+    def close_row(self, row_idx):
+        """
+        End a row with a bar, if it doesn't already.
+        """
+        if TABLE_BAR_END.match(self.lines[row_idx]):
+            return
+
+        length = self.row_lengths[row_idx]
+        if length == len(self.columns):
+            self.columns.append([''] * len(self))
+            if self._widths is not None:
+                self._widths.append(0)
+        self.columns[length][row_idx] = ''
+        self.row_lengths[row_idx] = length + 1
+        self._dirty.add(row_idx)
+
+    def align(self):
+        """
+        Pad every cell to the width of its column when rendering, giving every row every column.
+        """
+        self.aligned = True
+        self.row_lengths = array('l', [len(self.columns)]) * len(self)
+
+    def render(self):
+        """
+        Returns the lines of the table, rendering only the rows which need it.
+        """
+        widths = list(self.widths) if self.aligned else None
+        if widths != self._rendered_widths:
+            rows = range(len(self))
+        else:
+            rows = sorted(self._dirty)
+
+        lines = list(self.lines)
+        for row_idx in rows:
+            if widths is not None:
+                lines[row_idx] = '|'.join([column[row_idx].ljust(width)
+                                           for width, column in zip(widths, self.columns)])
+            else:
+                lines[row_idx] = '|'.join(self.row(row_idx))
+
+        self._dirty = set()
+        self._rendered_widths = widths
+        return lines
+
+    def write(self, buffer):
+        """
+        Write the table back to the buffer, only writing the lines which changed (so that tabbing around the
+        table doesn't mark the file as changed).
+        """
+        lines = self.render()
+        replace_lines(buffer, self.first_line_idx, self.lines, lines)
+        self.lines = lines
+
+def count_table_lines(lines):
+    count = 0
+    for line in lines:
+        if not TABLE_LINE_RE.match(line):
+            break
+        count += 1
+
+    return count
+
+def find_named_tables(lines):
+    """
+    Returns a dict mapping the name of each named table in 'lines' to the Table. A table is named by a line
+    containing '#' and the name, just above the table. If two tables have the same name, the first one wins.
+    """
+    tables = {}
+    for idx, line in enumerate(lines):
+        if '#' not in line:
+            continue
+
+        match = TABLE_NAME_RE.match(line)
+        if match is None or match.group(1) in tables:
+            continue
+
+        end_idx = idx + 1
+        while end_idx < len(lines) and TABLE_LINE_RE.match(lines[end_idx]):
+            end_idx += 1
+
+        if end_idx > idx + 1:
+            tables[match.group(1)] = Table(lines[idx + 1:end_idx], idx + 1)
+
+    return tables
+
+def _recalc_get_cell_rel(context, offset, is_row):
+    return context['cell_idx'][0] + offset if is_row else context['cell_idx'][1] + offset
+
+def _recalc_get_cell_idx_range(context, col_or_row_ref, is_row):
+    """
+    Returns a list of indices referenced by a ColOrRowRef.
+
+    Always returns a list (or a range, for ranges), which is single-element if the reference is not a range.
+    """
+
+    if col_or_row_ref[0] == 'range':
+        first = _recalc_get_cell_idx_range(context, col_or_row_ref[1][0], is_row)
+        last = _recalc_get_cell_idx_range(context, col_or_row_ref[1][1], is_row)
+        if len(first) != 1 or len(last) != 1:
+            return '?ROR'  # Don't support ranges of ranges
+        return range(first[0], last[0] + 1)
+    elif col_or_row_ref[0] == 'abs':
+        return [col_or_row_ref[1][0]]
+    elif col_or_row_ref[0] == 'rel':
+        offset = col_or_row_ref[1][0]
+        return [_recalc_get_cell_rel(context, offset, is_row)]
+    else:
+        return ['?UNKREF']
+
+def _recalc_get_cell_value(context, row, col):
+    """
+    Return the values of a cell reference (in square brackets).
+
+    Returns: a single-element list (one cell reference) or multi-element list (range reference). Cells outside the
+    table are '?NOCELL', as in references to other tables.
+    """
+    rows = _recalc_get_cell_idx_range(context, row, True)
+    cols = _recalc_get_cell_idx_range(context, col, False)
+
+    results = []
+    formulas = context['formulas']
+    values = context['values']
+
+    for row in rows:
+        for col in cols:
+            idx = (row, col)
+            if idx in formulas:
+                results.append(_recalc_one(idx, formulas, values, context))
+            else:
+                results.append('?NOCELL')
+
+    return results
+
+def _recalc_one(idx, formulas, values, context):
+    """
+    Evaluate the cell at idx, if it hasn't been evaluated already.
+
+    Any cells with references which this cell refers to must already have been evaluated (see _recalc_schedule),
+    so this never recurses more than one cell deep.
+    """
+    if idx not in values:
+        with context.newscope(cell_idx=idx):
+            try:
+                compiled = context['compiled'].get(idx)
+                if compiled is not None:
+                    value = compiled(context)
+                else:
+                    value = dis_eval(formulas[idx], context)
+            except Exception as e:
+                value = '?EXC' + str(e)
+
+            if isinstance(value, list):
+                # The result of _recalc_get_cell_value
+                assert len(value) == 1
+                value = value[0]
+
+            values[idx] = value
+
+    return values[idx]
+
+def _clip_indices(indices, size):
+    """
+    Returns the indices (a list or a range) which are in range(size), as the same kind of sequence.
+    """
+    if isinstance(indices, range):
+        return range(max(indices.start, 0), min(indices.stop, size))
+    return [index for index in indices if 0 <= index < size]
+
+def _recalc_refs(formula, idx, shape):
+    """
+    Returns the references made by 'formula' (an AST) in cell idx, as a list of (rows, cols) pairs.
+
+    Each reference is to every cell in the rows x cols block; rows and cols are sequences of indices. shape is the
+    (number of rows, number of columns) of the table: the parts of references outside it are left out, as those
+    cells read as '?NOCELL' (see _recalc_get_cell_value) rather than depending on anything.
+    """
+    refs = []
+    context = {'cell_idx': idx}
+    exprs = [formula]
+    while exprs:
+        expr = exprs.pop()
+        if isinstance(expr, tuple):
+            if expr[0] == 'cell':
+                rows = _recalc_get_cell_idx_range(context, expr[1][0], True)
+                cols = _recalc_get_cell_idx_range(context, expr[1][1], False)
+                if not isinstance(rows, str) and not isinstance(cols, str):  # Not an invalid range
+                    rows = _clip_indices(rows, shape[0])
+                    cols = _clip_indices(cols, shape[1])
+                    if rows and cols:
+                        refs.append((rows, cols))
+            elif expr[0] != 'tablecell':  # (references to other tables don't count)
+                exprs.extend(expr[1])
+        elif isinstance(expr, list):
+            exprs.extend(expr)
+
+    return refs
+
+def _recalc_refers_to_tables(formula):
+    """
+    Returns True if 'formula' (an AST) refers to cells of other tables.
+    """
+    exprs = [formula]
+    while exprs:
+        expr = exprs.pop()
+        if isinstance(expr, tuple):
+            if expr[0] == 'tablecell':
+                return True
+            exprs.extend(expr[1])
+        elif isinstance(expr, list):
+            exprs.extend(expr)
+
+    return False
+
+def _strongly_connected(nodes, deps):
+    """
+    Tarjan's algorithm, without recursion. Returns the strongly connected components of the graph
+    (as lists of nodes). deps maps a node to the set of nodes it has edges to.
+    """
+    index_of = {}
+    lowlink = {}
+    stack = []
+    on_stack = set()
+    components = []
+
+    for root in nodes:
+        if root in index_of:
+            continue
+
+        index_of[root] = lowlink[root] = len(index_of)
+        stack.append(root)
+        on_stack.add(root)
+        work = [(root, iter(deps[root]))]
+        while work:
+            node, edges = work[-1]
+            for dep in edges:
+                if dep not in index_of:
+                    index_of[dep] = lowlink[dep] = len(index_of)
+                    stack.append(dep)
+                    on_stack.add(dep)
+                    work.append((dep, iter(deps[dep])))
+                    break
+                elif dep in on_stack:
+                    lowlink[node] = min(lowlink[node], index_of[dep])
+            else:
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    lowlink[parent] = min(lowlink[parent], lowlink[node])
+
+                if lowlink[node] == index_of[node]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        component.append(member)
+                        if member == node:
+                            break
+                    components.append(component)
+
+    return components
+
+def _recalc_update_refs(refs, external, formulas, needs_evaluation, cells, shape):
+    """
+    Update 'refs' and 'external' for each of 'cells', in a table of the given (rows, columns) shape.
+
+    refs maps every formula in needs_evaluation, and every other cell containing references, to its _recalc_refs.
+    external is the set of cells which refer to other tables.
+    """
+    for idx in cells:
+        formula = formulas[idx]
+        is_expr = isinstance(formula, (tuple, list))
+        cell_refs = _recalc_refs(formula, idx, shape) if is_expr else []
+        if cell_refs or idx in needs_evaluation:
+            refs[idx] = cell_refs
+        else:
+            refs.pop(idx, None)
+
+        if is_expr and _recalc_refers_to_tables(formula):
+            external.add(idx)
+        else:
+            external.discard(idx)
+
+# Ranges covering more cells with references than this refer to segments of the column instead of to each cell.
+RANGE_SEGMENT_MIN = 16
+
+def _recalc_graph(refs, needs_evaluation):
+    """
+    Build the dependency graph of the cells which need evaluating.
+
+    Only cells containing references need to be in the graph: the formulas in needs_evaluation, plus any other
+    cells with references which they (directly or indirectly) refer to.
+
+    Long ranges refer to segment nodes (see _recalc_segments) rather than to every cell in them, so that, for
+    example, a column of running totals doesn't make a graph with a number of edges quadratic in its length.
+
+    Returns a dict mapping each of those cells (and segments) to the set of cells and segments it refers to.
+    """
+    # Index the cells with references by column, so that ranges only look at those cells.
+    rows_by_col = {}
+    for row, col in sorted(refs):
+        rows_by_col.setdefault(col, []).append(row)
+
+    deps = {}
+    pending = sorted(needs_evaluation)
+    while pending:
+        idx = pending.pop()
+        if idx in deps:
+            continue
+
+        if idx[0] == 'seg':
+            deps[idx] = cell_deps = set(_recalc_segment_children(idx, rows_by_col[idx[1]]))
+            pending.extend(cell_deps)
+            continue
+
+        deps[idx] = cell_deps = set()
+        for rows, cols in refs[idx]:
+            for col in cols:
+                if len(rows) <= 1:
+                    cell_deps.update((row, col) for row in rows if (row, col) in refs)
+                    continue
+
+                col_rows = rows_by_col.get(col, ())
+                lo = bisect_left(col_rows, rows[0])
+                hi = bisect_right(col_rows, rows[-1])
+                if hi - lo < RANGE_SEGMENT_MIN:
+                    cell_deps.update((row, col) for row in col_rows[lo:hi])
+                else:
+                    cell_deps.update(_recalc_segments(col, col_rows, lo, hi))
+
+        pending.extend(cell_deps)
+
+    return deps
+
+def _recalc_segment_node(col, col_rows, k):
+    """
+    Returns the graph node for node k of the segment tree over col_rows: a cell for leaves, or ('seg', col, k).
+    """
+    size = 1 << (len(col_rows) - 1).bit_length()
+    return (col_rows[k - size], col) if k >= size else ('seg', col, k)
+
+def _recalc_segments(col, col_rows, lo, hi):
+    """
+    Returns the nodes which together stand for the cells col_rows[lo:hi] of column col.
+
+    The cells with references in each column are the leaves of a segment tree (numbered as a binary heap, i.e.
+    node k has children 2k and 2k+1); each segment node depends on its children. Any run of cells is covered
+    by at most two nodes per level of the tree.
+    """
+    size = 1 << (len(col_rows) - 1).bit_length()
+    nodes = []
+    lo += size
+    hi += size
+    while lo < hi:
+        if lo & 1:
+            nodes.append(_recalc_segment_node(col, col_rows, lo))
+            lo += 1
+        if hi & 1:
+            hi -= 1
+            nodes.append(_recalc_segment_node(col, col_rows, hi))
+        lo >>= 1
+        hi >>= 1
+
+    return nodes
+
+def _recalc_segment_children(segment, col_rows):
+    size = 1 << (len(col_rows) - 1).bit_length()
+    _seg, col, k = segment
+    for child in (2 * k, 2 * k + 1):
+        # Skip children entirely past the end of the column (as the tree is padded to a power of two).
+        leftmost = child
+        while leftmost < size:
+            leftmost *= 2
+        if leftmost - size < len(col_rows):
+            yield _recalc_segment_node(col, col_rows, child)
+
+def _recalc_dependents(deps):
+    """
+    Invert a dependency graph: returns a dict mapping each cell to the list of cells referring to it.
+    """
+    dependents = {idx: [] for idx in deps}
+    for idx, cell_deps in deps.items():
+        for dep in cell_deps:
+            dependents[dep].append(idx)
+
+    return dependents
+
+def _recalc_dirty(changed, refs, deps):
+    """
+    Returns the cells in the graph which need re-evaluating after the cells in 'changed' were edited: those which
+    were edited or refer to an edited cell, and (transitively) every cell which refers to those.
+    """
+    dirty = set(idx for idx in changed if idx in deps)
+    for idx in deps:
+        for rows, cols in refs.get(idx, ()):  # (segments have no references of their own)
+            if any(rows and cols and rows[0] <= row <= rows[-1] and cols[0] <= col <= cols[-1]
+                   for row, col in changed):
+                dirty.add(idx)
+                break
+
+    dependents = _recalc_dependents(deps)
+    pending = list(dirty)
+    while pending:
+        for dependent in dependents[pending.pop()]:
+            if dependent not in dirty:
+                dirty.add(dependent)
+                pending.append(dependent)
+
+    return dirty
+
+def _recalc_schedule(deps):
+    """
+    Work out the order in which to evaluate the cells of a dependency graph (see _recalc_graph), so that every cell
+    is evaluated after the cells it refers to.
+
+    Returns (order, cycles): the cells to evaluate, in order, and a list of reference cycles, each a list of cells.
+    Cells in a cycle aren't in 'order', but cells referring to a cycle are, after it. Segments are in 'order' too,
+    but not in 'cycles'.
+    """
+    # Kahn's algorithm: repeatedly evaluate the cells whose references have all been evaluated.
+    dependents = _recalc_dependents(deps)
+    waiting_on = {idx: len(cell_deps) for idx, cell_deps in deps.items()}
+
+    def evaluate_ready(ready):
+        while ready:
+            idx = ready.popleft()
+            order.append(idx)
+            for dependent in dependents[idx]:
+                waiting_on[dependent] -= 1
+                if waiting_on[dependent] == 0:
+                    ready.append(dependent)
+
+    order = []
+    evaluate_ready(deque(idx for idx in deps if waiting_on[idx] == 0))
+
+    cycles = []
+    if len(order) < len(deps):
+        # Whatever is left is in a cycle, or refers to one.
+        scheduled = set(order)
+        unscheduled = [idx for idx in deps if idx not in scheduled]
+        components = [component for component in _strongly_connected(unscheduled, deps)
+                      if len(component) > 1 or component[0] in deps[component[0]]]
+        cycles = [sorted(idx for idx in component if idx[0] != 'seg') for component in components]
+
+        # Treat the cycles as evaluated (to an error), and schedule the cells which refer to them.
+        in_cycle = set(idx for component in components for idx in component)
+        ready = deque()
+        for idx in in_cycle:
+            for dependent in dependents[idx]:
+                waiting_on[dependent] -= 1
+                if waiting_on[dependent] == 0 and dependent not in in_cycle:
+                    ready.append(dependent)
+        evaluate_ready(ready)
+
+    return order, cycles
+
+def _recalc_line_range(context, arg):
+    """
+    If 'arg' (an AST) is a reference to cells in a single column or row, returns (aggregate, first, end): the
+    LineAggregate of that column or row, and the range of it referred to.
+
+    Returns None for anything else, or if the aggregate can't read the range (yet), or reading part of it
+    failed; the caller should then evaluate 'arg' normally (which raises the error, if there was one).
+    """
+    if not (isinstance(arg, tuple) and arg[0] == 'cell'):
+        return None
+
+    rows = _recalc_get_cell_idx_range(context, arg[1][0], True)
+    cols = _recalc_get_cell_idx_range(context, arg[1][1], False)
+    if isinstance(rows, str) or isinstance(cols, str):
+        return None
+
+    if len(cols) == 1:
+        is_row, line, positions = False, cols[0], rows
+    elif len(rows) == 1:
+        is_row, line, positions = True, rows[0], cols
+    else:
+        return None
+
+    if not positions:
+        first = end = 0
+    else:
+        first, end = positions[0], positions[-1] + 1
+        if not isinstance(first, int) or not isinstance(line, int) or first < 0 or line < 0:
+            return None
+
+    aggregates = context['aggregates']
+    aggregate = aggregates.get((is_row, line))
+    if aggregate is None:
+        aggregate = aggregates[(is_row, line)] = LineAggregate(_recalc_line_reader(context, is_row, line))
+
+    if not aggregate.extend(end) or aggregate.has_failed(first, end):
+        return None
+
+    return aggregate, first, end
+
+def _recalc_line_reader(context, is_row, line):
+    """
+    Returns a function reading the values of a column or row for a LineAggregate.
+
+    Cells with references which haven't been evaluated yet aren't read, as evaluating them now could go
+    against the order worked out by _recalc_schedule.
+    """
+    formulas = context['formulas']
+    values = context['values']
+    refs = context['refs']
+
+    def read(position):
+        idx = (line, position) if is_row else (position, line)
+        if idx not in formulas or (idx not in values and refs.get(idx)):
+            return UNAVAILABLE
+        return _recalc_one(idx, formulas, values, context)
+
+    return read
+
+def _recalc_numbers(context, arg):
+    """
+    Evaluate 'arg' and return the numbers in the result, ignoring empty cells and text.
+    """
+    value = dis_eval(arg, context)
+    return [item for item in (value if isinstance(value, list) else [value]) if isinstance(item, NUMBER_TYPES)]
+
+def _recalc_sum(context, *args):
+    result = 0
+    for arg in args:
+        line_range = _recalc_line_range(context, arg)
+        if line_range is not None:
+            aggregate, first, end = line_range
+            line_sum = aggregate.sum(first, end)
+            if line_sum is not None:
+                result += line_sum
+                continue
+
+        result += sum(_recalc_numbers(context, arg))
+
+    return result
+
+def _recalc_count(context, *args):
+    result = 0
+    for arg in args:
+        line_range = _recalc_line_range(context, arg)
+        if line_range is not None:
+            result += line_range[0].count(*line_range[1:])
+        else:
+            result += len(_recalc_numbers(context, arg))
+
+    return result
+
+def _recalc_avg(context, *args):
+    total = 0
+    count = 0
+    for arg in args:
+        line_range = _recalc_line_range(context, arg)
+        if line_range is not None:
+            aggregate, first, end = line_range
+            total += aggregate.numeric_sum(first, end)
+            count += aggregate.count(first, end)
+        else:
+            numbers = _recalc_numbers(context, arg)
+            total += sum(numbers)
+            count += len(numbers)
+
+    return total / count if count else '?EMPTY'
+
+def _recalc_extreme(method, fn):
+    def extreme(context, *args):
+        candidates = []
+        for arg in args:
+            line_range = _recalc_line_range(context, arg)
+            if line_range is not None:
+                candidate = getattr(line_range[0], method)(*line_range[1:])
+                if candidate is not None:
+                    candidates.append(candidate)
+            else:
+                candidates.extend(_recalc_numbers(context, arg))
+
+        return fn(candidates) if candidates else '?EMPTY'
+
+    return extreme
+
+def _recalc_get_table_cell_value(context, name, row, col):
+    """
+    Return the values of a reference to cells of another table (in square brackets, starting with the name of the
+    table).
+
+    Returns: a list, as _recalc_get_cell_value does.
+    """
+    table = context['tables'].get(name)
+    if table is None:
+        return ['?NOTABLE']
+
+    rows = _recalc_get_cell_idx_range(context, row, True)
+    cols = _recalc_get_cell_idx_range(context, col, False)
+    if isinstance(rows, str) or isinstance(cols, str):
+        return ['?ROR']
+
+    return [_table_cell_value(table, row, col) for row in rows for col in cols]
+
+def _table_cell_value(table, row_idx, col_idx):
+    """
+    Returns the value shown in a cell (at 0-indexed row_idx, col_idx) of a Table: the result of its formula, if it
+    has one, or else its contents.
+    """
+    if not (0 <= row_idx < len(table) and 0 <= col_idx < table.row_lengths[row_idx] - 1):
+        return '?NOCELL'
+
+    text = table.columns[col_idx + 1][row_idx]
+    formula_match = TABLE_CELL_FORMULA.match(text)
+    if formula_match:
+        text = text[formula_match.end() + 1:]
+
+    try:
+        value = parse_literal(text)
+    except ParseError:
+        return text.strip()
+
+    if value is NOT_A_LITERAL or isinstance(value, tuple):
+        return text.strip()
+    return value
+
+SPREADSHEET_CONTEXT = DEFAULT_CONTEXT.copy()
+SPREADSHEET_CONTEXT.push({
+    'sum': _recalc_sum,
+    'avg': _recalc_avg,
+    'min': _recalc_extreme('min', min),
+    'max': _recalc_extreme('max', max),
+    'count': _recalc_count,
+    'cell': _recalc_get_cell_value,  # for evaluating cell references
+    'tablecell': _recalc_get_table_cell_value,  # ... and references to cells of other tables
+})
+
+# Compiled formulas, keyed by formula text. These are compiled against SPREADSHEET_CONTEXT, so are shared
+# by every table.
+FORMULA_CACHE = ParseCache(lambda formula_str: dis_compile(parse_cell(formula_str), SPREADSHEET_CONTEXT))
+
+class RecalcState:
+    """
+    What recalc worked out about a table, kept so that the next recalculation of the same table only has to
+    re-evaluate what changed.
+    """
+    __slots__ = ('content_hash', 'sources', 'formulas', 'compiled', 'refs', 'external', 'values')
+
+    def __init__(self):
+        self.content_hash = None
+        self.sources = {}  # maps (y, x) to (formula string, whether it's a formula to evaluate)
+        self.formulas = {}  # maps (y, x) to parsed formula
+        self.compiled = {}  # maps (y, x) to compiled formula, for cells which need evaluation
+        self.refs = {}  # see _recalc_update_refs
+        self.external = set()  # ditto
+        self.values = {}  # maps (y, x) to value (both 0 indexed)
+
+def recalc(table, state, named_tables):
+    """
+    Updates 'table' (a Table) with the results of each expression.
+
+    state: the RecalcState left by the last recalculation of this table, or None. If the table still has the same
+    shape, only cells which changed since then, and cells which refer to them, are re-evaluated.
+
+    named_tables: a function returning the named tables (see find_named_tables) which formulae may refer to. It
+    is only called if they do.
+
+    Returns (state, cycles): the RecalcState to pass next time, and the reference cycles found, each a list of
+    cells.
+    """
+    # Find all the formulas.
+    sources = {}
+    for row_idx in range(len(table)):
+        for cell_idx, cell in enumerate(table.row(row_idx)[1:]):  # skip the initial pre-table portion
+            formula_match = TABLE_CELL_FORMULA.match(cell)
+            if formula_match:
+                sources[(row_idx, cell_idx)] = (formula_match.group(1), True)
+            else:
+                sources[(row_idx, cell_idx)] = (cell, False)
+
+    content_hash = hash(tuple(sources.values()))
+    needs_evaluation = set(idx for idx, (_formula_str, is_formula) in sources.items() if is_formula)
+
+    if state is None or state.sources.keys() != sources.keys():
+        state = RecalcState()
+        changed = set(sources)
+    elif state.content_hash == content_hash and state.sources == sources:
+        changed = set()
+    else:
+        changed = set(idx for idx, source in sources.items() if state.sources[idx] != source)
+
+    # Other tables may have changed since last time, so cells referring to them are always re-evaluated.
+    changed |= state.external
+
+    formulas = state.formulas
+    compiled = state.compiled
+    values = state.values
+
+    context = SPREADSHEET_CONTEXT.copy()
+    context.push({
+        'table': table,
+        'values': values,
+        'formulas': formulas,
+        'compiled': compiled,
+        'refs': state.refs,
+        'aggregates': {},  # LineAggregates, keyed by (is_row, row or column index)
+    })
+
+    cycles = []
+    if changed:
+        # Parse the formulas which changed.
+        for idx in changed:
+            formula_str, is_formula = sources[idx]
+            compiled.pop(idx, None)
+            try:
+                formulas[idx] = parse_cell(formula_str)
+                if is_formula:
+                    compiled[idx] = FORMULA_CACHE.parse(formula_str)
+            except Exception:
+                formulas[idx] = '?PARSE' + formula_str
+
+        _recalc_update_refs(state.refs, state.external, formulas, needs_evaluation, changed,
+                            (len(table), len(table.columns) - 1))
+        if state.external:
+            context['tables'] = named_tables()
+
+        deps = _recalc_graph(state.refs, needs_evaluation)
+
+        # Forget the values of cells which need re-evaluating.
+        if len(changed) == len(sources):
+            values.clear()
+        else:
+            for idx in changed | _recalc_dirty(changed, state.refs, deps):
+                values.pop(idx, None)
+
+        # Evaluate the formulas, each after the cells it refers to.
+        order, cycles = _recalc_schedule(deps)
+        for cycle in cycles:
+            for idx in cycle:
+                values[idx] = '?CYCLE'
+
+        for idx in order:
+            if idx[0] != 'seg':
+                _recalc_one(idx, formulas, values, context)
+
+    for idx in needs_evaluation:
+        value = _recalc_one(idx, formulas, values, context)
+
+        # Update the table with the value.
+        table.set_cell(idx[0], idx[1] + 1, '=' + sources[idx][0] + '=' + str(value))
+
+    context.pop()
+
+    state.content_hash = content_hash
+    state.sources = sources
+    return state, cycles
+
+def find_tables(lines):
+    """
+    Returns (first, end) line indices of every table in 'lines'.
+    """
+    spans = []
+    idx = 0
+    while idx < len(lines):
+        if TABLE_LINE_RE.match(lines[idx]):
+            end_idx = idx + 1
+            while end_idx < len(lines) and TABLE_LINE_RE.match(lines[end_idx]):
+                end_idx += 1
+            spans.append((idx, end_idx))
+            idx = end_idx
+        else:
+            idx += 1
+
+    return spans
+
+def recalc_lines(lines):
+    """
+    Recalculate and align every table in 'lines' (a list of lines, which is updated).
+
+    Tables are recalculated from the top down, so references to named tables further down see the values
+    shown there before this recalculation.
+
+    Returns the reference cycles found, as a list of (first line index of table, cycle) pairs.
+    """
+    named = None
+
+    def named_tables():
+        nonlocal named
+        if named is None:
+            named = find_named_tables(lines)
+        return named
+
+    all_cycles = []
+    for first_idx, end_idx in find_tables(lines):
+        table = Table(lines[first_idx:end_idx], first_idx)
+        _state, cycles = recalc(table, None, named_tables)
+        all_cycles.extend((first_idx, cycle) for cycle in cycles)
+
+        table.align()
+        table.write(lines)
+        if named is not None and first_idx > 0:
+            # If this is a named table, others now see its new values.
+            match = TABLE_NAME_RE.match(lines[first_idx - 1])
+            if match is not None and named[match.group(1)].first_line_idx == first_idx:
+                named[match.group(1)] = Table(lines[first_idx:end_idx], first_idx)
+
+    return all_cycles
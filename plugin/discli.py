@@ -0,0 +1,117 @@
+"""
+Recalculate and align the tables in disorganiser files, without Vim.
+
+    disorganiser [--check] [--jobs N] FILE...
+
+Each file is rewritten (atomically) only if something in it changed. Files are spread across a pool of
+processes.
+"""
+import argparse
+import concurrent.futures
+import os
+import sys
+import tempfile
+
+from discalc import recalc_lines
+from disexpr import FORMULA_PARSERS, use_formula_parser
+
+def _write_atomically(path, text):
+    """
+    Replace the contents of 'path' with 'text', so that anything reading it sees either the old or the new file.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.' + os.path.basename(path) + '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8', newline='') as temp_file:
+            temp_file.write(text)
+            temp_file.flush()
+            os.fsync(temp_file.fileno())
+
+        os.chmod(temp_path, os.stat(path).st_mode & 0o7777)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+def _split_lines(text):
+    """
+    Returns (lines, endings): the lines of 'text' without their line endings, and the ending of each ('\n', '\r\n',
+    or '' for the last). Each line keeps its own ending, so that files edited on Windows (or a mix) aren't changed
+    beyond the tables.
+    """
+    lines = text.split('\n')
+    endings = ['\r\n' if line.endswith('\r') else '\n' for line in lines[:-1]] + ['']
+    lines = [line[:-1] if ending == '\r\n' else line for line, ending in zip(lines, endings)]
+    return lines, endings
+
+def process_file(path, check=False):
+    """
+    Recalculate and align every table in the file at 'path', writing it back if it changed (unless 'check').
+
+    Returns (path, changed, messages, error): 'messages' describes any reference cycles, and 'error' is the text
+    of the exception which stopped the file being processed, or None.
+    """
+    try:
+        with open(path, encoding='utf-8', newline='') as f:
+            text = f.read()
+
+        lines, endings = _split_lines(text)
+        cycles = recalc_lines(lines)
+        new_text = ''.join(line + ending for line, ending in zip(lines, endings))
+        changed = new_text != text
+        if changed and not check:
+            _write_atomically(path, new_text)
+    except Exception as e:
+        return path, False, [], '%s: %s' % (type(e).__name__, e)
+
+    messages = ['reference cycle between cells %s in the table on line %d'
+                % (', '.join('[%d %d]' % idx for idx in cycle), first_idx + 1) for first_idx, cycle in cycles]
+    return path, changed, messages, None
+
+def _process_files(paths, check, jobs, formula_parser):
+    if jobs <= 1 or len(paths) <= 1:
+        for path in paths:
+            yield process_file(path, check)
+        return
+
+    # Send the files to the workers in batches, as each one is usually quick.
+    chunksize = max(1, min(64, len(paths) // (jobs * 4)))
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs, initializer=use_formula_parser,
+                                                initargs=(formula_parser,)) as executor:
+        yield from executor.map(process_file, paths, [check] * len(paths), chunksize=chunksize)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='disorganiser',
+                                     description='Recalculate and align the tables in disorganiser files.')
+    parser.add_argument('files', nargs='+', metavar='FILE')
+    parser.add_argument('--check', action='store_true',
+                        help="don't write anything; exit with status 1 if any file would change")
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count() or 1,
+                        help='number of processes to use (default: the number of CPUs)')
+    parser.add_argument('--parser', choices=sorted(FORMULA_PARSERS), default='pratt',
+                        help='how to parse formulae (default: pratt)')
+    parser.add_argument('-v', '--verbose', action='store_true', help='list the files which changed')
+    args = parser.parse_args(argv)
+    use_formula_parser(args.parser)
+
+    num_changed = 0
+    num_failed = 0
+    for path, changed, messages, error in _process_files(args.files, args.check, args.jobs, args.parser):
+        for message in messages:
+            print('%s: %s' % (path, message), file=sys.stderr)
+        if error is not None:
+            print('%s: %s' % (path, error), file=sys.stderr)
+            num_failed += 1
+        elif changed:
+            num_changed += 1
+            if args.verbose or args.check:
+                print(path)
+
+    if num_failed:
+        return 2
+    if args.check and num_changed:
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
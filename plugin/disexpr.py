@@ -1,8 +1,11 @@
+import re
 import decimal
 import math
+import operator
 import contextlib
+from collections import OrderedDict
 
-from parsy import string, regex, seq, generate, eof
+from parsy import string, regex, seq, generate, eof, ParseError
 
 WS = regex(r'\s*')
 PLUS = string('+') << WS
@@ -34,7 +37,9 @@ DirRef = (string('l') >> WS >> Int).map(lambda single: ('cell', [('rel', [0]), (
         | (string('r') >> WS >> Int).map(lambda single: ('cell', [('rel', [0]), ('rel', [single])])) \
         | (string('u') >> WS >> Int).map(lambda single: ('cell', [('rel', [-single]), ('rel', [0])])) \
         | (string('d') >> WS >> Int).map(lambda single: ('cell', [('rel', [single]), ('rel', [0])]))
-CellRef = (LSQUARE >> (ExplicitRef | DirRef) << RSQUARE)
+TableName = regex(r'[A-Za-z_][A-Za-z0-9_]*') << string(':') << WS
+TableRef = seq(TableName, ExplicitRef).combine(lambda name, ref: ('tablecell', [name] + ref[1]))
+CellRef = (LSQUARE >> (TableRef | ExplicitRef | DirRef) << RSQUARE)
 
 def combine_expr(*args):
     return args
@@ -57,26 +62,30 @@ def ExprBracketed():
 def ExprList():  # using generate to break circular dependency between Expr and ExprList
     exprs = []
     while True:
-        expr = yield Expr.optional()
+        expr = yield OptionalExpr
         if not expr:
             break
         exprs.append(expr)
 
-        comma = yield COMMA.optional()
+        comma = yield OptionalComma
         if not comma:
             break
 
     return exprs
 
 def _expr_generator(sub_expr, oper):
+    # (The parsers are built once, here, rather than on every call.)
+    sub_expr = sub_expr << WS
+    oper = oper.optional()
+
     @generate
     def parse_expr():
-        result = yield sub_expr << WS
-        oper_val = yield oper.optional()
+        result = yield sub_expr
+        oper_val = yield oper
         while oper_val:
-            rhs = yield sub_expr << WS
+            rhs = yield sub_expr
             result = (oper_val, [result, rhs])
-            oper_val = yield oper.optional()
+            oper_val = yield oper
 
         return result
     return parse_expr
@@ -86,6 +95,8 @@ ExprFunction = seq(IDENTIFIER,  LBRACKET >> ExprList << RBRACKET).combine(lambda
 ExprOptBracket = ExprBracketed | ExprFunction | ExprBasic
 ExprMulDiv = _expr_generator(ExprOptBracket, STAR | SLASH)
 Expr = _expr_generator(ExprMulDiv, PLUS | MINUS)
+OptionalExpr = Expr.optional()
+OptionalComma = COMMA.optional()
 
 class EmptyCell:
     def eh(self, other):
@@ -100,6 +111,310 @@ TheEmptyCell = EmptyCell()
 
 Cell = (WS >> Expr.optional() << eof).map(lambda expr: expr if expr is not None else TheEmptyCell)
 
+class ParseCache:
+    """
+    Bounded least-recently-used cache of parse results, keyed by the parsed string.
+
+    'parse' is called with the string on a miss. Parse failures are cached as well, and raise a
+    ParseError on every lookup. The cached results are shared, so must not be modified.
+    """
+    def __init__(self, parse, maxsize=4096):
+        self._parse = parse
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # text -> (True, AST) or (False, ParseError)
+
+    def parse(self, text):
+        entry = self._entries.get(text)
+        if entry is None:
+            self.misses += 1
+            try:
+                entry = (True, self._parse(text))
+            except ParseError as e:
+                entry = (False, e)
+
+            self._entries[text] = entry
+            if len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        else:
+            self.hits += 1
+            self._entries.move_to_end(text)
+
+        parsed, result = entry
+        if not parsed:
+            raise ParseError(result.expected, result.stream, result.index)
+        return result
+
+    def set_parser(self, parse):
+        """
+        Call 'parse' on a miss from now on, forgetting what the old one gave.
+        """
+        self._parse = parse
+        self.clear()
+
+    def clear(self):
+        self._entries.clear()
+        self.hits = self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+# A faster parser giving exactly the same results as the Cell grammar (including its quirks): a tokenizer, and a
+# precedence-climbing parser over the tokens. Cell references are parsed as they are tokenized.
+
+# Tokens are (kind, value, index). Kinds are 'num', 'str', 'ident', 'ref', 'end', or the character for punctuation.
+_OPERAND_TOKEN = re.compile(r'''\s*(?:
+    (?P<num>-?[0-9]+(?:\.[0-9]*)?)
+    | "(?P<str>[^"]*)"
+    | (?P<ident>[A-Za-z_][A-Za-z0-9_]*)
+    | (?P<ref>\[)
+    | (?P<punct>[-+*/(),])
+)''', re.VERBOSE)
+# After an operand, a minus sign is always an operator (e.g. in '1 -2').
+_OPERATOR_TOKEN = re.compile(_OPERAND_TOKEN.pattern.replace('-?[0-9]', '[0-9]', 1), re.VERBOSE)
+_TRAILING_WS = re.compile(r'\s*\Z')
+
+_REF_WS = re.compile(r'\s*')
+_REF_INT = re.compile(r'(-?[0-9]+)\s*')
+_REF_TABLE_NAME = re.compile(r'([A-Za-z_][A-Za-z0-9_]*):\s*')
+_REF_DIRECTIONS = {'l': (0, -1), 'r': (0, 1), 'u': (-1, 0), 'd': (1, 0)}
+
+_PRECEDENCE = {'+': 1, '-': 1, '*': 2, '/': 2}
+
+def _parse_error(text, index, expected):
+    return ParseError(frozenset([expected]), text, index)
+
+def _parse_single_ref(text, index):
+    """
+    Returns (ref, index after it) for a single row or column reference, or (None, index) if there isn't one.
+    """
+    if text.startswith('@', index):
+        match = _REF_INT.match(text, index + 1)
+        if match is None:
+            return None, index
+        return ('rel', [int(match.group(1))]), match.end()
+
+    # (No whitespace is skipped after these.)
+    if text.startswith('before', index):
+        return ('rel', [-1]), index + 6
+    if text.startswith('after', index):
+        return ('rel', [1]), index + 5
+    if text.startswith('this', index):
+        return ('rel', [0]), index + 4
+
+    match = _REF_INT.match(text, index)
+    if match is None:
+        return None, index
+    return ('abs', [int(match.group(1))]), match.end()
+
+def _parse_line_ref(text, index):
+    """
+    As _parse_single_ref, but for a single reference or a range.
+    """
+    ref, index = _parse_single_ref(text, index)
+    if ref is not None and text.startswith('..', index):
+        last, last_index = _parse_single_ref(text, index + 2)
+        if last is not None:
+            return ('range', [ref, last]), last_index
+
+    return ref, index
+
+def _parse_explicit_ref(text, index):
+    """
+    Returns ([row ref, column ref], index after them), or (None, index) if they aren't there.
+    """
+    row, row_end = _parse_line_ref(text, index)
+    if row is None:
+        return None, index
+
+    col, col_end = _parse_line_ref(text, _REF_WS.match(text, row_end).end())
+    if col is None:
+        return None, index
+
+    return [row, col], col_end
+
+def _parse_ref(text, index):
+    """
+    Parse a cell reference whose '[' is at 'index'. Returns (ref, index after the ']').
+    """
+    index = _REF_WS.match(text, index + 1).end()
+
+    ref = None
+    match = _REF_TABLE_NAME.match(text, index)
+    if match is not None:
+        cell, end = _parse_explicit_ref(text, match.end())
+        if cell is not None:
+            ref = ('tablecell', [match.group(1)] + cell)
+
+    if ref is None:
+        cell, end = _parse_explicit_ref(text, index)
+        if cell is not None:
+            ref = ('cell', cell)
+
+    if ref is None and text[index:index + 1] in _REF_DIRECTIONS:
+        match = _REF_INT.match(text, _REF_WS.match(text, index + 1).end())
+        if match is not None:
+            rows, cols = _REF_DIRECTIONS[text[index]]
+            distance = int(match.group(1))
+            ref, end = ('cell', [('rel', [rows * distance]), ('rel', [cols * distance])]), match.end()
+
+    if ref is None:
+        raise _parse_error(text, index, 'cell reference')
+    if not text.startswith(']', end):
+        raise _parse_error(text, end, ']')
+
+    return ref, end + 1
+
+def _tokenize(text):
+    tokens = []
+    index = 0
+    token_re = _OPERAND_TOKEN
+    while True:
+        match = token_re.match(text, index)
+        if match is None:
+            end = _TRAILING_WS.match(text, index)
+            if end is None:
+                raise _parse_error(text, _REF_WS.match(text, index).end(), 'token')
+            tokens.append(('end', None, end.end()))
+            return tokens
+
+        kind = match.lastgroup
+        start = match.start(kind)
+        index = match.end()
+        if kind == 'num':
+            value = match.group('num')
+            value = decimal.Decimal(value) if '.' in value else int(value)
+        elif kind == 'str':
+            value = match.group('str')
+        elif kind == 'ident':
+            value = match.group('ident')
+        elif kind == 'ref':
+            value, index = _parse_ref(text, start)
+        else:
+            kind = value = match.group('punct')
+
+        tokens.append((kind, value, start))
+        token_re = _OPERATOR_TOKEN if kind in ('num', 'str', 'ident', 'ref', ')') else _OPERAND_TOKEN
+
+def _parse_operand(text, tokens, pos):
+    kind, value, index = tokens[pos]
+    if kind in ('num', 'str', 'ref'):
+        return value, pos + 1
+    elif kind == 'ident':
+        if tokens[pos + 1][0] != '(':
+            return ('ident', (value,)), pos + 1
+
+        # Function call. As in ExprList, an argument which is falsy (such as 0) ends the argument list.
+        pos += 2
+        args = []
+        while tokens[pos][0] != ')':
+            arg, pos = _parse_expr(text, tokens, pos, 1)
+            if not arg:
+                break
+            args.append(arg)
+            if tokens[pos][0] != ',':
+                break
+            pos += 1
+
+        return (value, args), _expect(text, tokens, pos, ')')
+    elif kind == '(':
+        expr, pos = _parse_expr(text, tokens, pos + 1, 1)
+        return expr, _expect(text, tokens, pos, ')')
+
+    raise _parse_error(text, index, 'expression')
+
+def _parse_expr(text, tokens, pos, min_precedence):
+    lhs, pos = _parse_operand(text, tokens, pos)
+    while True:
+        oper = tokens[pos][0]
+        precedence = _PRECEDENCE.get(oper)
+        if precedence is None or precedence < min_precedence:
+            return lhs, pos
+
+        rhs, pos = _parse_expr(text, tokens, pos + 1, precedence + 1)
+        lhs = (oper, [lhs, rhs])
+
+def _expect(text, tokens, pos, kind):
+    if tokens[pos][0] != kind:
+        raise _parse_error(text, tokens[pos][2], kind)
+    return pos + 1
+
+def parse_formula(text):
+    """
+    Parse a cell as the Cell grammar does, giving the same result (or raising ParseError when it would), but faster.
+    """
+    tokens = _tokenize(text)
+    if tokens[0][0] == 'end':
+        return TheEmptyCell
+
+    expr, pos = _parse_expr(text, tokens, 0, 1)
+    _expect(text, tokens, pos, 'end')
+    return expr
+
+# Ways of parsing cells, for use_formula_parser.
+FORMULA_PARSERS = {
+    'pratt': parse_formula,
+    'parsy': Cell.parse,
+}
+
+# Process-wide cache of parsed cells, shared by every table.
+CELL_CACHE = ParseCache(parse_formula)
+
+def use_formula_parser(name):
+    """
+    Parse cells with the named entry of FORMULA_PARSERS from now on.
+    """
+    CELL_CACHE.set_parser(FORMULA_PARSERS[name])
+
+# Most table cells are just a number, a string, or some words. This matches exactly the cells which
+# the Cell grammar parses to a single Decimal, Int, String or Identifier (or to nothing), plus plain
+# text made of several identifier-like words, which the grammar rejects.
+LITERAL = re.compile(r'''\s*(?:
+    (?P<decimal>-?[0-9]+\.[0-9]*)
+    | (?P<int>-?[0-9]+)
+    | "(?P<string>[^"]*)"
+    | (?P<ident>[A-Za-z_][A-Za-z0-9_]*) (?P<text>(?:\s+[A-Za-z_][A-Za-z0-9_]*)+)?
+)?\s*''', re.VERBOSE)
+
+NOT_A_LITERAL = object()
+
+def parse_literal(text):
+    """
+    Parse a cell which is a literal without using the Cell grammar, giving the same result.
+
+    Returns NOT_A_LITERAL if the cell is not a literal (so needs the grammar), and raises
+    ParseError if it is plain text.
+    """
+    match = LITERAL.fullmatch(text)
+    if match is None:
+        return NOT_A_LITERAL
+
+    kind = match.lastgroup
+    if kind is None:
+        return TheEmptyCell
+    elif kind == 'decimal':
+        return decimal.Decimal(match.group('decimal'))
+    elif kind == 'int':
+        return int(match.group('int'))
+    elif kind == 'string':
+        return match.group('string')
+    elif kind == 'ident':
+        return ('ident', (match.group('ident'),))
+    else:
+        raise ParseError(frozenset(['EOF']), text, match.start('text'))
+
+def parse_cell(text):
+    """
+    Parse the contents of a table cell (or a formula). Literals are parsed directly and everything
+    else goes through the cell cache.
+    """
+    literal = parse_literal(text)
+    if literal is not NOT_A_LITERAL:
+        return literal
+
+    return CELL_CACHE.parse(text)
+
 def dis_eval(expr, context=None):
     if context is None:
         context = DEFAULT_CONTEXT.copy()
@@ -116,6 +431,35 @@ def dis_eval(expr, context=None):
     else:
         return "A suffusion of yellow (%s)" % (type(expr),)
 
+def dis_compile(expr, context):
+    """
+    Compile expr to a function of a context, which returns the same value as dis_eval(expr, context).
+
+    Operators and functions are looked up in 'context' once, here, rather than on every evaluation (names
+    which aren't in 'context' yet are looked up when evaluated). Operators with a 'dis_compile' attribute
+    compile their own arguments; others are called with the uncompiled arguments, as with dis_eval.
+    """
+    if isinstance(expr, (int, decimal.Decimal, str)):
+        return lambda context: expr
+    elif isinstance(expr, tuple):
+        name, args = expr
+        try:
+            oper = context[name]
+        except KeyError:
+            return lambda context: context[name](context, *args)
+
+        compile_oper = getattr(oper, 'dis_compile', None)
+        if compile_oper is not None:
+            return compile_oper(context, *args)
+        return lambda context: oper(context, *args)
+    elif isinstance(expr, list):
+        elems = [dis_compile(elem, context) for elem in expr]
+        return lambda context: [elem(context) for elem in elems]
+    elif hasattr(expr, 'dis_eval'):
+        return expr.dis_eval
+    else:
+        return lambda context: dis_eval(expr, context)
+
 class Scopes:
     def __init__(self, *scopes):
         self.scopes = list(scopes)
@@ -154,8 +498,10 @@ class Scopes:
     @contextlib.contextmanager
     def newscope(self, **scope_vals):
         self.push(scope_vals)
-        yield
-        self.pop()
+        try:
+            yield
+        finally:
+            self.pop()
 
     def dumps(self):
         return repr(self.scopes)
@@ -174,16 +520,45 @@ def unlist(elem):
         return elem[0]
     return elem
 
+def _function(fn):
+    """
+    A function of one evaluated argument, such as math.sin.
+    """
+    def evaluate(context, val):
+        return fn(dis_eval(val, context))
+
+    def compile_function(context, val):
+        val = dis_compile(val, context)
+        return lambda context: fn(val(context))
+
+    evaluate.dis_compile = compile_function
+    return evaluate
+
+def _operator(op):
+    """
+    A binary operator, such as operator.add. Cell references on either side must be to a single cell.
+    """
+    def evaluate(context, lhs, rhs):
+        return op(unlist(dis_eval(lhs, context)), unlist(dis_eval(rhs, context)))
+
+    def compile_operator(context, lhs, rhs):
+        lhs = dis_compile(lhs, context)
+        rhs = dis_compile(rhs, context)
+        return lambda context: op(unlist(lhs(context)), unlist(rhs(context)))
+
+    evaluate.dis_compile = compile_operator
+    return evaluate
+
 DEFAULT_CONTEXT = Scopes({
     'pi': math.pi,
-    'sin': lambda context, val: math.sin(dis_eval(val, context)),
-    'cos': lambda context, val: math.cos(dis_eval(val, context)),
-    'tan': lambda context, val: math.tan(dis_eval(val, context)),
-    'sqrt': lambda context, val: math.sqrt(dis_eval(val, context)),
-    '+': lambda context, lhs, rhs: unlist(dis_eval(lhs, context)) + unlist(dis_eval(rhs, context)),
-    '-': lambda context, lhs, rhs: unlist(dis_eval(lhs, context)) - unlist(dis_eval(rhs, context)),
-    '*': lambda context, lhs, rhs: unlist(dis_eval(lhs, context)) * unlist(dis_eval(rhs, context)),
-    '/': lambda context, lhs, rhs: unlist(dis_eval(lhs, context)) / unlist(dis_eval(rhs, context)),
+    'sin': _function(math.sin),
+    'cos': _function(math.cos),
+    'tan': _function(math.tan),
+    'sqrt': _function(math.sqrt),
+    '+': _operator(operator.add),
+    '-': _operator(operator.sub),
+    '*': _operator(operator.mul),
+    '/': _operator(operator.truediv),
     'ident': lambda context, ident: context[ident],
 })
 
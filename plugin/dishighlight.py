@@ -0,0 +1,146 @@
+"""
+Highlighting of disorganiser lines, following the rules in syntax/disorganiser.vim. Used to highlight large files
+with text properties rather than the regex syntax (see g:disorganiser_textprop_threshold).
+
+This module doesn't use Vim.
+"""
+import functools
+import re
+
+# Every highlight group which tokenize_line can give.
+GROUPS = ['disH%d' % (level,) for level in range(1, 9)] + [
+    'disHidden', 'disQuote1', 'disQuote2', 'disQuote3', 'disUL', 'disTR', 'disTableBar', 'disTableFormula',
+    'disTableName', 'disTag', 'disTODO', 'disDONE', 'disLink', 'disDate', 'disFoldStart', 'disFoldEnd',
+    'disLiteral', 'disSubtle']
+
+# Lines tokenized recently, by their text.
+LINE_CACHE_SIZE = 16384
+
+# The end of a word (Vim's \>), taking ideographs and the like as words of their own.
+_WORD_END = r'(?![^\W\u3000-\U0010ffff])'
+
+# The @disInline cluster.
+_INLINE = [
+    r'(?P<disTag>:[A-Za-z0-9._@:]+:)',
+    r'(?P<disLink>\[\[)',
+    r'(?P<disTODO>TODO' + _WORD_END + ')',
+    r'(?P<disDONE>DONE' + _WORD_END + ')',
+    r'(?P<disDate><[0-9]{4}-[0-9]{2}-[0-9]{2}(?: [A-Za-z]{3})?>)',
+    r'(?P<disFoldStart>\{\{\{)',
+    r'(?P<disFoldEnd>\}\}\})',
+]
+
+# What can start inside each kind of line: outside any region; in a table row; in any other region.
+_TOP_ITEM_RE = re.compile('|'.join(_INLINE + [r'(?P<disLiteral>`)']))
+_TABLE_ITEM_RE = re.compile('|'.join(_INLINE + [r'(?P<disTableBar>\|)', r'(?P<disTableFormula>[ \t]*=)']))
+_INLINE_ITEM_RE = re.compile('|'.join(_INLINE))
+
+_HEADING_RE = re.compile(r'(\*{1,8}) ')
+
+# The other regions which start at the beginning of a line (and run to its end): (start, group, what can start
+# inside). The first to match is used, as the later ones in the syntax file take priority.
+_LINE_REGIONS = [
+    (re.compile(r'> ?> ?>'), 'disQuote3', _INLINE_ITEM_RE),
+    (re.compile(r'> ?>'), 'disQuote2', _INLINE_ITEM_RE),
+    (re.compile(r'>'), 'disQuote1', _INLINE_ITEM_RE),
+    (re.compile(r'[ \t]+[-+*]'), 'disUL', _INLINE_ITEM_RE),
+    (re.compile(r'[ \t]*\|'), 'disTR', _TABLE_ITEM_RE),
+]
+
+_TABLE_NAME_RE = re.compile(r'[ \t]*#[A-Za-z_][A-Za-z0-9_]*[ \t]*')
+_FORMULA_END_RE = re.compile(r'[=|]')
+
+def _add(tokens, start, end, group):
+    if start < end and group is not None:
+        if tokens and tokens[-1][1] == start and tokens[-1][2] == group:
+            tokens[-1] = (tokens[-1][0], end, group)
+        else:
+            tokens.append((start, end, group))
+
+def _delimited(line, tokens, start, open_len, close, group):
+    """
+    Adds the tokens of a region like [[...]] starting at 'start', with its delimiters highlighted as disSubtle.
+    Returns where it ends. If it isn't closed, it runs to the end of the line.
+    """
+    body = start + open_len
+    _add(tokens, start, body, 'disSubtle')
+    end = line.find(close, body)
+    if end == -1:
+        _add(tokens, body, len(line), group)
+        return len(line)
+
+    _add(tokens, body, end, group)
+    _add(tokens, end, end + len(close), 'disSubtle')
+    return end + len(close)
+
+def _scan(line, pos, group, item_re, tokens):
+    """
+    Adds the tokens of line[pos:], which is highlighted as 'group' (or not at all, if None) apart from the items
+    matched by 'item_re'.
+    """
+    while True:
+        match = item_re.search(line, pos)
+        if match is None:
+            break
+
+        start = match.start()
+        _add(tokens, pos, start, group)
+        item = match.lastgroup
+        if item == 'disLink':
+            pos = _delimited(line, tokens, start, 2, ']]', 'disLink')
+        elif item == 'disLiteral':
+            pos = _delimited(line, tokens, start, 1, '`', 'disLiteral')
+        elif item == 'disTableFormula':
+            # Ends with an '=' (included), or before the '|' ending the cell.
+            end_match = _FORMULA_END_RE.search(line, match.end())
+            if end_match is None:
+                pos = len(line)
+            else:
+                pos = end_match.end() if end_match.group() == '=' else end_match.start()
+            _add(tokens, start, pos, item)
+        else:
+            pos = match.end()
+            _add(tokens, start, pos, item)
+
+    _add(tokens, pos, len(line), group)
+
+def _to_bytes(line, tokens):
+    """
+    Converts the (character) offsets in 'tokens' to offsets into the line as UTF-8.
+    """
+    offsets = {}
+    for start, end, _group in tokens:
+        for offset in (start, end):
+            if offset not in offsets:
+                offsets[offset] = len(line[:offset].encode('utf-8'))
+    return [(offsets[start], offsets[end], group) for start, end, group in tokens]
+
+@functools.lru_cache(maxsize=LINE_CACHE_SIZE)
+def tokenize_line(line):
+    """
+    Returns the highlighting of 'line' as a tuple of (start, end, group), in order and not overlapping: the bytes
+    line[start:end] (in UTF-8) are highlighted as 'group'. Text which isn't highlighted isn't covered.
+
+    Every syntax region here ends at the end of its line, except [[ and ` (and formulae in tables) which needn't;
+    here they also end at the end of the line if they aren't closed on it.
+    """
+    tokens = []
+    heading = _HEADING_RE.match(line)
+    if heading:
+        # All but the last asterisk are hidden.
+        level = len(heading.group(1))
+        _add(tokens, 0, level - 1, 'disHidden')
+        _scan(line, level - 1, 'disH%d' % (level,), _INLINE_ITEM_RE, tokens)
+    elif _TABLE_NAME_RE.fullmatch(line):
+        _add(tokens, 0, len(line), 'disTableName')
+    else:
+        for start_re, group, item_re in _LINE_REGIONS:
+            if start_re.match(line):
+                _scan(line, 0, group, item_re, tokens)
+                break
+        else:
+            _scan(line, 0, None, _TOP_ITEM_RE, tokens)
+
+    if not line.isascii():
+        tokens = _to_bytes(line, tokens)
+    return tuple(tokens)
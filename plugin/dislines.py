@@ -0,0 +1,38 @@
+"""
+Helpers for working with lists of lines (including Vim buffers), which don't use Vim themselves.
+"""
+
+def changed_span(old_lines, new_lines):
+    """
+    Compare two lists of lines, ignoring their common prefix and suffix.
+
+    Returns (start, end_old, end_new): old_lines[start:end_old] became new_lines[start:end_new].
+    """
+    start = 0
+    end_old = len(old_lines)
+    end_new = len(new_lines)
+
+    while start < end_old and start < end_new and old_lines[start] == new_lines[start]:
+        start += 1
+
+    while end_old > start and end_new > start and old_lines[end_old - 1] == new_lines[end_new - 1]:
+        end_old -= 1
+        end_new -= 1
+
+    return start, end_old, end_new
+
+def replace_lines(buffer, first_idx, old_lines, new_lines):
+    """
+    Replace old_lines, which start at index first_idx in buffer, with new_lines.
+
+    Only the span that actually differs is written back, using a single slice assignment, so
+    unchanged lines don't cost a call into Vim (and an unchanged range doesn't modify the buffer).
+
+    Returns True if the buffer was modified.
+    """
+    start, end_old, end_new = changed_span(old_lines, new_lines)
+    if start == end_old and start == end_new:
+        return False
+
+    buffer[first_idx + start:first_idx + end_old] = new_lines[start:end_new]
+    return True
@@ -0,0 +1,43 @@
+"""
+Links ([[...]]) in a buffer.
+
+This module doesn't use Vim.
+"""
+import re
+
+LINK_RE = re.compile(r'\[\[(.*?)\]\]')
+
+def find_links(line):
+    """
+    Returns the links in 'line', as a list of (start, end, target): the link is line[start:end], including the
+    brackets, and 'target' is the text between them.
+    """
+    return [(match.start(), match.end(), match.group(1)) for match in LINK_RE.finditer(line)]
+
+class LinkIndex:
+    """
+    The links on each line of a buffer, found as each line is first asked about.
+
+    The index is only valid for one version of the buffer (see 'changedtick'); make a new one when it changes.
+    """
+    def __init__(self, changedtick):
+        self.changedtick = changedtick
+        self._rows = {}  # (0-indexed) row -> find_links of that line
+
+    def link_at(self, row, col, read_line):
+        """
+        Returns the target of the link at (0-indexed) row and col, or None if there isn't one.
+
+        read_line(row): returns the line at 'row', if it hasn't been looked at yet.
+        """
+        links = self._rows.get(row)
+        if links is None:
+            links = self._rows[row] = find_links(read_line(row))
+
+        for start, end, target in links:
+            if start <= col < end:
+                return target
+            if col < start:
+                break
+
+        return None
@@ -1,13 +1,23 @@
 import vim
 
-def dis_visual_perline_op(fn):
-    orig_row, orig_col = vim.current.window.cursor
+from dislines import replace_lines
+
+def dis_visual_apply(transform):
+    """
+    Transform the lines of the last visual selection as a whole.
+
+    'transform' is passed the list of selected lines and returns the replacement list (of the same length). The
+    lines are read from Vim with one slice, and only the lines which changed are written back.
+    """
     first_line = int(vim.eval('getpos("\'<")')[1])
     last_line = int(vim.eval('getpos("\'>")')[1])
 
-    for line in range(first_line, last_line + 1):
-        vim.current.window.cursor = (line, orig_row)
-        fn()
-
-    vim.current.window.cursor = (orig_row, orig_col)
+    buffer = vim.current.buffer
+    lines = buffer[first_line - 1:last_line]
+    replace_lines(buffer, first_line - 1, lines, transform(list(lines)))
 
+def dis_visual_op(callback):
+    """
+    Apply 'callback', which takes a line and returns its replacement, to every line of the last visual selection.
+    """
+    dis_visual_apply(lambda lines: [callback(line) for line in lines])
@@ -1,12 +1,23 @@
 import sys
+import contextlib
 import datetime
+import os
 import re
 import subprocess
+import tempfile
+import time
 
 import vim
 
 from distable import dis_in_table, dis_table_tab, dis_table_cr, dis_table_reformat, dis_make_table_visual
-from disops import dis_visual_perline_op
+from disops import dis_visual_op
+from dislines import replace_lines
+from disoutline import OutlineIndex, RE_TODO, count_stars as _count_stars
+from dislinks import LinkIndex
+from dishighlight import GROUPS as HIGHLIGHT_GROUPS, tokenize_line
+from disscan import ScanCache, Scanner, default_cache_path, parse_file, parse_files
+from disagenda import agenda_items
+from dissearch import search_headings
 
 # General annoyance here is the difference between vim.current.window.cursor, which returns
 # 1-indexed rows, and vim.current.buffer, which is 0-indexed. It makes for a lot of row - 1
@@ -14,30 +25,53 @@ from disops import dis_visual_perline_op
 
 RE_UL = re.compile(r'[ \t]+[-+\*]')
 RE_LEADING_SPACES = re.compile(r'^( *)')
-RE_TODO = re.compile(r'^(\*+)([ \t]*)(TODO |DONE )?(.*$)')
 
 TODO_CYCLE = {'': 'TODO ', 'TODO ': 'DONE ', 'DONE ': ''}
 
 def current_row_0indexed():
     return vim.current.window.cursor[0] - 1
 
-def _count_stars(line):
-    if not line.startswith('*'):
-        return 0
+# Outline indexes by buffer number. Each is rebuilt only when its buffer's changedtick moves.
+_outline_indexes = {}
 
-    return line.split(' ')[0].count('*')
+def _outline_index():
+    """
+    Returns the OutlineIndex of the current buffer.
+    """
+    buf = vim.current.buffer
+    if 'disorganiser_listener' in buf.vars:
+        # Incremental mode: bring the index up to date with any changes Vim hasn't reported yet.
+        vim.eval('listener_flush()')
 
-def _count_stars_nearest_outline_line_above(row):
+    changedtick = int(vim.eval('b:changedtick'))
+
+    index = _outline_indexes.get(buf.number)
+    if index is None or index.changedtick != changedtick:
+        index = OutlineIndex(buf[:], changedtick)
+        _outline_indexes[buf.number] = index
+
+    return index
+
+def dis_outline_listener(bufnr, changes):
     """
-    does _count_stars for each line begining at (vim) row 'row' until we get a nonzero result.
+    Vim change listener (see listener_add()) which patches the outline index of buffer 'bufnr' in place.
+
+    changes: the list of changes passed to the listener, in the order they were made.
     """
-    while row > 0:
-        stars = _count_stars(vim.current.buffer[row - 1])
-        if stars > 0:
-            return stars
-        row -= 1
+    index = _outline_indexes.get(bufnr)
+    if index is None:
+        return  # Nothing to patch; the index will be built when it's first needed.
 
-    return 0
+    buf = vim.buffers[bufnr]
+    index.apply_changes([(int(change['lnum']) - 1, int(change['end']) - 1, int(change['added'])) for change in changes],
+                        lambda first, end: buf[first:end])
+    index.changedtick = int(vim.eval('getbufvar(%d, "changedtick")' % (bufnr,)))
+
+def _count_stars_nearest_outline_line_above(row):
+    """
+    does _count_stars for the closest outline line at or above (vim) row 'row'. Returns 0 if there isn't one.
+    """
+    return _outline_index().level_at_or_above(row - 1)
 
 def _find_nearest_outline_row_idx_above():
     """
@@ -45,14 +79,7 @@ def _find_nearest_outline_row_idx_above():
 
     Returns -1 if there is no outline at or above.
     """
-    row, _col = vim.current.window.cursor
-    while row >= 1:
-        if vim.current.buffer[row - 1].startswith('*'):
-            return row - 1
-
-        row -= 1
-
-    return -1
+    return _outline_index().row_at_or_above(current_row_0indexed())
 
 def _indent_line(line):
     if line.startswith('*'):
@@ -67,40 +94,37 @@ def dis_indent():
     vim.current.line = _indent_line(vim.current.line)
 
 def dis_indent_visual():
-    dis_visual_perline_op(dis_indent)
+    dis_visual_op(_indent_line)
 
 def dis_dedent_visual():
-    dis_visual_perline_op(dis_dedent)
+    dis_visual_op(_dedent_line)
 
-def _subtree_op(callback, include_nonoutline_lines=True):
+def _subtree_apply(transform):
     """
-    used to perform an operation on every line of a subtree (such as indent, dedent, or fold)
+    Transform the subtree under the cursor as a whole.
 
-    include_nonoutline_lines: if True, consider lines not starting with * part of the subtree
-    (at whatever level the most recent outline line was)
+    'transform' is passed the list of lines in the subtree and returns the replacement list (of the same length).
+    The subtree is read from Vim with one slice, and only the lines which changed are written back.
 
-    returns the final row in vim (1-base) co-ordinates
+    returns the final row of the subtree in buffer (0-based) co-ordinates, or None if not on an outline.
     """
-    stop_at = _count_stars(vim.current.line)
-    if stop_at == 0:
-        return  # Not on an outline.
+    if _count_stars(vim.current.line) == 0:
+        return None  # Not on an outline.
 
-    row, _col = vim.current.window.cursor
-    buf = vim.current.window.buffer
+    row_idx = current_row_0indexed()
+    _first, end = _outline_index().subtree_range(row_idx)
+    lines = vim.current.window.buffer[row_idx:end]
+    replace_lines(vim.current.window.buffer, row_idx, lines, transform(list(lines)))
 
-    # Always change the current line.
-    buf[row - 1] = callback(buf[row - 1])
+    return end - 1
 
-    while len(buf) > row:
-        line = buf[row]
-        num_stars = _count_stars(line)
-        if num_stars and num_stars <= stop_at and not (include_nonoutline_lines is False and num_stars == 0):
-            break
-
-        buf[row] = callback(buf[row])
-        row += 1
+def _subtree_op(callback):
+    """
+    used to perform an operation on every line of a subtree (such as indent, dedent, or fold)
 
-    return row - 1
+    returns the final row of the subtree in buffer (0-based) co-ordinates
+    """
+    return _subtree_apply(lambda lines: [callback(line) for line in lines])
 
 def dis_indent_subtree():
     _subtree_op(_indent_line)
@@ -162,16 +186,10 @@ def dis_outline_insert_after_children():
     """
     Insert a new outline line at the same level as the current one, after any children.
     """
-    current_stars = _count_stars_nearest_outline_line_above(vim.current.window.cursor[0])
-    row = vim.current.window.cursor[0]
-
-    while row < len(vim.current.buffer):
-        num_stars = _count_stars(vim.current.buffer[row])
-
-        if num_stars > 0 and num_stars < current_stars:
-            break
-
-        row += 1
+    index = _outline_index()
+    current_row_idx = current_row_0indexed()
+    current_stars = index.level_at_or_above(current_row_idx)
+    row = index.end_of_siblings(current_row_idx)
 
     _insert_outline_and_append(row, current_stars)
 
@@ -222,22 +240,50 @@ def dis_fold_cycle():
     fold_level = vim.eval('foldclosed(' + str(vim.current.window.cursor[0]) + ')')
     is_open = int(fold_level) == -1
 
+    if vim.eval('&foldmethod') == 'expr':
+        _fold_cycle_expr(is_open)
+        return
+
     def remove_markers(line):
         line = line.replace('{{{', '')
         line = line.replace('}}}', '')
         return line
 
-    final_row = _subtree_op(remove_markers)
+    def refold(lines):
+        lines = [remove_markers(line) for line in lines]
+        if is_open:
+            # Desired behaviour: close all folds, so mark the top and bottom lines.
+            lines[0] += '{{{'
+            lines[-1] += '}}}'
+        # Otherwise, desired behaviour is to open all folds. Removing the markers does this for us.
+        return lines
+
+    _subtree_apply(refold)
 
     if is_open:
-        # Desired behaviour: close all folds.
-        vim.current.line += '{{{'
-        vim.current.window.buffer[final_row] += '}}}'
         vim.command('foldclose')
-    else:
-        # Desired behaviour: open all folds (and remove markers)
-        # Removing the markers does this for us.
-        pass
+
+def _fold_cycle_expr(is_open):
+    """
+    dis_fold_cycle for g:disorganiser_fold_mode 'expr', where the folds follow the headings (see dis_fold_levels), so
+    nothing needs writing to the buffer.
+    """
+    index = _outline_index()
+    row_idx = current_row_0indexed()
+    first, end = index.subtree_range(row_idx)
+
+    # Open every fold in the subtree.
+    vim.command('silent! %d,%dfoldopen!' % (first + 1, end))
+
+    if is_open:
+        # Close them again, one level at each heading, from the innermost out, so that each closes its own fold.
+        vim.command('|'.join('silent! %dfoldclose' % (row + 1,) for row in index.fold_rows(row_idx)))
+
+def dis_fold_levels():
+    """
+    The fold level of every line of the current buffer, for disorganiser#foldexpr.
+    """
+    return _outline_index().fold_levels()
 
 def dis_tab():
     """
@@ -314,6 +360,204 @@ def dis_cycle_todo_or_reformat_table():
     else:
         dis_cycle_todo()
 
+# Scans of a directory of files (see disscan). The cached results are shown straight away; the files are then looked
+# at, and any changed ones read, by a timer, so that the command returns at once. When more than this many files have
+# changed, they are read in a pool of processes rather than by the timer itself.
+SCAN_IN_VIM_MAX = 20
+SCAN_POLL_MS = 100
+# Time (in seconds) spent storing files at each tick of the timer, so that Vim isn't held up for long. Files are
+# stored this many at a time until it runs out.
+SCAN_STORE_SECONDS = 0.05
+SCAN_STORE_FILES = 8
+# How often the results are shown again while the files are read.
+SCAN_SHOW_SECONDS = 1.0
+
+class _Scan:
+    """
+    A scan in progress: the directory, the ScanCache the records go into, the function showing the results, and the
+    timer doing the work. Once the changed files are known, 'scanner' is the Scanner reading them, and 'parsed' holds
+    the files it has read which haven't been stored yet.
+    """
+    def __init__(self, directory, cache, show, timer):
+        self.directory = directory
+        self.cache = cache
+        self.show = show
+        self.timer = timer
+        self.scanner = None
+        self.parsed = []
+        self.num_stored = 0
+        self.shown_at = time.monotonic()
+
+_scan = None
+
+def _scan_directory(directory, show):
+    """
+    Show the results for the files under 'directory', and bring the scan cache up to date with them.
+
+    show(cache, num_left) displays the results. It's called straight away with what's in the cache, and 'num_left'
+    None. If any files have changed, it's called again as they are read, until 'num_left' (the number of files still
+    to read) is 0. A scan still in progress is abandoned.
+    """
+    _stop_scan()
+    cache = ScanCache(default_cache_path())
+    if not _vim_config_exists('*timer_start'):
+        try:
+            cache.scan(directory)
+            show(cache, 0)
+        finally:
+            cache.close()
+        return
+
+    global _scan
+    try:
+        show(cache, None)
+    except BaseException:
+        cache.close()
+        raise
+    timer = int(vim.eval("timer_start(%d, 'DisorganiserScanPoll', {'repeat': -1})" % (SCAN_POLL_MS,)))
+    _scan = _Scan(directory, cache, show, timer)
+
+def _stop_scan():
+    global _scan
+    if _scan is not None:
+        vim.eval('timer_stop(%d)' % (_scan.timer,))
+        if _scan.scanner is not None:
+            _scan.scanner.close()
+        _scan.cache.close()
+        _scan = None
+
+def _scan_start(scan):
+    """
+    The first tick of a scan: find the files which have changed, and read them (if there are only a few) or start
+    reading them in the pool. Returns whether there is more to do.
+    """
+    stale, removed = scan.cache.changes(scan.directory)
+    scan.cache.update([], removed)
+    if len(stale) <= SCAN_IN_VIM_MAX:
+        scan.cache.update(parse_files(stale))
+        if stale or removed:
+            scan.show(scan.cache, 0)
+        return False
+
+    scan.scanner = Scanner(stale)
+    scan.show(scan.cache, len(stale))
+    scan.shown_at = time.monotonic()
+    return True
+
+def _scan_store(scan):
+    """
+    A later tick of a scan: store the files read since the last one, for at most SCAN_STORE_SECONDS (leaving the rest
+    for the next). Returns whether there is more to do.
+    """
+    scan.parsed.extend(scan.scanner.poll())
+    deadline = time.monotonic() + SCAN_STORE_SECONDS
+    while scan.parsed and time.monotonic() < deadline:
+        scan.cache.update(scan.parsed[:SCAN_STORE_FILES])
+        scan.num_stored += len(scan.parsed[:SCAN_STORE_FILES])
+        del scan.parsed[:SCAN_STORE_FILES]
+
+    num_left = scan.scanner.num_files - scan.num_stored
+    if num_left == 0 or time.monotonic() - scan.shown_at >= SCAN_SHOW_SECONDS:
+        scan.show(scan.cache, num_left)
+        scan.shown_at = time.monotonic()
+    return num_left > 0
+
+def dis_scan_poll():
+    """
+    Do the next step of the scan in progress. Called from a timer.
+    """
+    scan = _scan
+    if scan is None:
+        return
+
+    try:
+        more = _scan_start(scan) if scan.scanner is None else _scan_store(scan)
+    except BaseException:
+        _stop_scan()
+        raise
+
+    if not more:
+        _stop_scan()
+
+def _show_in_quickfix(title, find, noun):
+    """
+    Returns a function showing results in a quickfix list, for _scan_directory.
+
+    find(cache): returns the quickfix items to show, as dicts like setqflist() takes.
+    noun: what the items are, for the message giving how many there are.
+    """
+    quickfix_id = None
+
+    def show(cache, num_left):
+        nonlocal quickfix_id
+        items = find(cache)
+        what = {'title': title, 'items': items}
+        if quickfix_id is None:
+            vim.Function('setqflist')([], ' ', what)
+            quickfix_id = int(vim.eval('getqflist({"id": 0}).id'))
+            vim.command('copen')
+        else:
+            # (Replace this list, even if another has been made since.)
+            what['id'] = quickfix_id
+            vim.Function('setqflist')([], 'r', what)
+
+        if num_left is None:
+            left = ' (looking for changed files)'
+        else:
+            left = ' (%d files still to read)' % (num_left,) if num_left else ''
+        print('%d %s%s' % (len(items), noun, left))
+
+    return show
+
+def _notes_directory(directory=''):
+    """
+    Returns the absolute path of 'directory', or by default of g:disorganiser_agenda_dir, or else the current file's
+    directory.
+    """
+    if not directory:
+        directory = _vim_get_config('g:disorganiser_agenda_dir') or os.path.dirname(vim.current.buffer.name) or '.'
+    return os.path.abspath(os.path.expanduser(directory))
+
+def dis_agenda(directory=''):
+    """
+    List the TODO headings and dated lines of the files under 'directory' (see _notes_directory) in the quickfix
+    window, in date order. If many files need reading, the list fills in as they are read.
+    """
+    directory = _notes_directory(directory)
+
+    def find(cache):
+        return [{'filename': path, 'lnum': row + 1, 'text': ' '.join(part for part in (date, state, text) if part)}
+                for date, path, row, state, text in agenda_items(cache, directory)]
+
+    _scan_directory(directory, _show_in_quickfix('Agenda: ' + directory, find, 'items'))
+
+def dis_search(query):
+    """
+    List the headings with the words of 'query' in them, of the files under g:disorganiser_agenda_dir (or else the
+    current file's directory), in the quickfix window, best first.
+
+    They are found in the index as it is (kept up to date as files are written, see dis_scan_written), and found
+    again if the files turn out to have been changed some other way.
+    """
+    directory = _notes_directory()
+
+    def find(cache):
+        return [{'filename': path, 'lnum': row + 1,
+                 'text': ' '.join(part for part in ('*' * level, state, text) if part)}
+                for path, row, level, state, text in search_headings(cache, query, directory)]
+
+    _scan_directory(directory, _show_in_quickfix('Search: ' + query, find, 'headings'))
+
+def dis_scan_written(path):
+    """
+    Bring the scan cache up to date with the file at 'path', which has just been written. Does nothing if no
+    multi-file command has been used yet (so there's no cache).
+    """
+    cache_path = default_cache_path()
+    if os.path.exists(cache_path):
+        with contextlib.closing(ScanCache(cache_path)) as cache:
+            cache.update([parse_file(os.path.abspath(path))])
+
 def _vim_config_exists(name):
     return vim.eval(f'exists("{name}")') != '0'
 
@@ -338,17 +582,178 @@ def _vim_get_url_open_command():
 
         return open_cmd
 
-def _mouse_open_url():
-    # Are we in a url?
-    current_line = vim.current.line
-    current_cursor = vim.current.window.cursor[1]
+# URL opener processes which haven't finished yet, as (url, Popen, file holding its stderr). See _open_url.
+_url_openers = []
+_url_opener_timer = None
+URL_OPENER_POLL_MS = 250
+
+def _open_url(url):
+    """
+    Start the URL open command on 'url', without waiting for it. Failures are reported when it exits.
+    """
+    dis_reap_url_openers()  # (in case there are no timers)
+
+    url_open_command = _vim_get_url_open_command()
+    if not url_open_command:
+        return
+
+    stderr = tempfile.TemporaryFile()
+    try:
+        # In a session of its own, so that it isn't tied to Vim's terminal.
+        process = subprocess.Popen([url_open_command, url], stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                                   stderr=stderr, start_new_session=True)
+    except OSError as e:
+        stderr.close()
+        print("Couldn't open %s: %s" % (url, e))
+        return
+
+    _url_openers.append((url, process, stderr))
+
+    global _url_opener_timer
+    if _url_opener_timer is None and _vim_config_exists('*timer_start'):
+        _url_opener_timer = int(vim.eval("timer_start(%d, 'DisorganiserReapUrlOpeners', {'repeat': -1})"
+                                         % (URL_OPENER_POLL_MS,)))
+
+def dis_reap_url_openers():
+    """
+    Collect the URL open commands which have finished, and report any which failed. Called from a timer.
+    """
+    global _url_opener_timer
+    running = []
+    for url, process, stderr in _url_openers:
+        returncode = process.poll()
+        if returncode is None:
+            running.append((url, process, stderr))
+            continue
+
+        if returncode != 0:
+            stderr.seek(0)
+            message = stderr.read().decode(errors='replace').strip()
+            print("Couldn't open %s: %s exited with status %d%s" % (
+                url, process.args[0], returncode, ': ' + message if message else ''))
+        stderr.close()
+
+    _url_openers[:] = running
+    if not running and _url_opener_timer is not None:
+        vim.eval('timer_stop(%d)' % (_url_opener_timer,))
+        _url_opener_timer = None
+
+# Link indexes by buffer number. Each is replaced when its buffer's changedtick moves.
+_link_indexes = {}
 
-    url_start = current_line.rfind('[[', 0, current_cursor)
-    url_end = current_line.find(']]', current_cursor)
+def _link_index():
+    """
+    Returns the LinkIndex of the current buffer.
+    """
+    buf = vim.current.buffer
+    changedtick = int(vim.eval('b:changedtick'))
+
+    index = _link_indexes.get(buf.number)
+    if index is None or index.changedtick != changedtick:
+        index = _link_indexes[buf.number] = LinkIndex(changedtick)
+
+    return index
+
+# Text property highlighting, for large files (see syntax/disorganiser.vim). Lines this far above and below the window
+# are highlighted as well, so that scrolling a little doesn't need anything doing.
+HIGHLIGHT_MARGIN = 100
+# The id of every text property added, so that they can be removed without touching any others.
+HIGHLIGHT_PROP_ID = 4242
+
+class _HighlightState:
+    """
+    What has been highlighted in a buffer.
+    """
+    def __init__(self):
+        self.view = None  # (changedtick, top row, bottom row) of the window when last highlighted
+        self.num_lines = 0
+        self.rows = {}  # (0-indexed) row -> the line there when it was highlighted
+
+# Highlight states by buffer number.
+_highlight_states = {}
+# Vim functions used to highlight, once the property types are defined.
+_prop_functions = None
+
+def _highlight_prop_functions():
+    """
+    Returns (prop_remove, add_props), defining a property type for each highlight group the first time.
+
+    add_props(group, positions) adds a property of that group at each [lnum, col, end_lnum, end_col].
+    """
+    global _prop_functions
+    if _prop_functions is None:
+        prop_type_get = vim.Function('prop_type_get')
+        prop_type_add = vim.Function('prop_type_add')
+        for group in HIGHLIGHT_GROUPS:
+            if not prop_type_get(group):
+                prop_type_add(group, {'highlight': group})
+
+        if _vim_config_exists('*prop_add_list'):
+            prop_add_list = vim.Function('prop_add_list')
+            def add_props(group, positions):
+                prop_add_list({'type': group, 'id': HIGHLIGHT_PROP_ID}, positions)
+        else:
+            prop_add = vim.Function('prop_add')
+            def add_props(group, positions):
+                for lnum, col, end_lnum, end_col in positions:
+                    prop_add(lnum, col, {'type': group, 'id': HIGHLIGHT_PROP_ID, 'end_lnum': end_lnum,
+                                         'end_col': end_col})
 
-    if url_start != -1 and url_start <= current_cursor and url_end != -1 and url_end >= current_cursor:
-        url = current_line[url_start + 2:url_end]
+        _prop_functions = (vim.Function('prop_remove'), add_props)
+
+    return _prop_functions
+
+def dis_highlight(reset=False):
+    """
+    Highlight the lines in and around the current window which have changed since they were last highlighted. Called
+    whenever the window might have moved or the buffer changed. 'reset': highlight them all again.
+    """
+    buf = vim.current.buffer
+    state = _highlight_states.get(buf.number)
+    if state is None or reset:
+        state = _highlight_states[buf.number] = _HighlightState()
+
+    view = tuple(int(value) for value in vim.eval('[b:changedtick, line("w0"), line("w$")]'))
+    if view == state.view:
+        return
+    state.view = view
+
+    if len(buf) != state.num_lines:
+        # Lines have come or gone, so the rows no longer hold the lines which were highlighted there.
+        state.rows.clear()
+        state.num_lines = len(buf)
+
+    _changedtick, top, bottom = view
+    first = max(top - 1 - HIGHLIGHT_MARGIN, 0)
+    stale = []
+    positions = {}  # group -> [lnum, col, end_lnum, end_col] of each property to add
+    for row, line in enumerate(buf[first:bottom + HIGHLIGHT_MARGIN], first):
+        if state.rows.get(row) == line:
+            continue
+        state.rows[row] = line
+        stale.append(row)
+        for start, end, group in tokenize_line(line):
+            positions.setdefault(group, []).append([row + 1, start + 1, row + 1, end + 1])
+
+    if not stale:
+        return
+
+    prop_remove, add_props = _highlight_prop_functions()
+    run_start = stale[0]
+    for prev_row, row in zip(stale, stale[1:] + [None]):
+        if row != prev_row + 1:
+            prop_remove({'id': HIGHLIGHT_PROP_ID, 'all': 1}, run_start + 1, prev_row + 1)
+            run_start = row
+
+    for group, group_positions in positions.items():
+        add_props(group, group_positions)
+
+def _mouse_open_url():
+    # Are we in a url?
+    row, col = vim.current.window.cursor
+    url = _link_index().link_at(row - 1, col, lambda row_idx: vim.current.buffer[row_idx])
 
+    if url is not None:
         # Copy the URL to the unnamed register, as if we'd yanked this URL.
         vim.command('let @" = "%s"' % (url.replace('"', r'\"'),))
 
@@ -356,9 +761,7 @@ def _mouse_open_url():
             url = 'http://' + url
 
         # Invoke whatever is registered on this system to handle URLs.
-        url_open_command = _vim_get_url_open_command()
-        if url_open_command:
-            subprocess.call([url_open_command, url])
+        _open_url(url)
         return True  # Event was handled, don't bubble up to Vim.
 
     return False # Event was not handled, invoke default Vim behaviour.
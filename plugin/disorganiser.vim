@@ -1,16 +1,41 @@
-python3 <<EOF
-import sys
-import os
-import vim
-
-plugin_dir = os.path.dirname(vim.eval('expand("<sfile>")'))
-sys.path.insert(0, plugin_dir)
-
-from disorganiser import dis_indent, dis_indent_visual, dis_indent_subtree, \
-	dis_dedent, dis_dedent_visual, dis_dedent_subtree, \
-	dis_outline_insert_above_children, dis_outline_insert_after_children, \
-	dis_outline_insert_above_current,  dis_list_insert_above_children, dis_tab, \
-	dis_itab, dis_date_insert, dis_cr, dis_table_reformat, \
-	dis_cycle_todo_or_reformat_table, dis_make_table_visual, dis_mouse
-
-EOF
+" The Python side is only loaded when the first disorganiser buffer is opened, or a command is first used; see
+" autoload/disorganiser.vim.
+
+" List the TODO headings and dates in the files under a directory (see dis_agenda) in the quickfix window.
+command! -nargs=? -complete=dir DisAgenda call disorganiser#agenda(<q-args>)
+
+" List the headings with the given words in them, in the files :DisAgenda looks at, in the quickfix window.
+command! -nargs=+ DisSearch call disorganiser#search(<q-args>)
+
+" Profile the Python commands (with ! to include cProfile statistics); use again to stop and see the results.
+command! -bang DisProfile call disorganiser#profile('<bang>')
+
+" Incremental outline index: patch the index from a change listener rather than rebuilding it after every change.
+function! DisorganiserOutlineListener(bufnr, start, end, added, changes)
+	call disorganiser#load()
+	execute 'python3 dis_outline_listener(' . a:bufnr . ', vim.eval("a:changes"))'
+endfunction
+
+" URL open commands run in the background; this timer callback collects them and reports failures.
+function! DisorganiserReapUrlOpeners(timer)
+	python3 dis_reap_url_openers()
+endfunction
+
+" Files scanned by multi-file commands such as :DisAgenda are read in other processes; this timer callback collects
+" what they've read so far.
+function! DisorganiserScanPoll(timer)
+	python3 dis_scan_poll()
+endfunction
+
+augroup disorganiser_scan
+	autocmd!
+	autocmd BufWritePost *.dis call disorganiser#scan_written(expand('<afile>:p'))
+augroup END
+
+augroup disorganiser_outline
+	autocmd!
+	autocmd FileType disorganiser
+		\ if get(g:, 'disorganiser_incremental_outline', 0) && exists('*listener_add') && !exists('b:disorganiser_listener')
+		\ | let b:disorganiser_listener = listener_add('DisorganiserOutlineListener')
+		\ | endif
+augroup END
@@ -0,0 +1,179 @@
+"""
+Outline structure of a buffer: where the headings are, their levels, and how they nest.
+
+This module doesn't use Vim, so that it can also be used on plain lists of lines.
+"""
+from bisect import bisect_left, bisect_right
+import re
+
+# A heading: its stars, the space after them, TODO or DONE if it has one, and the rest.
+RE_TODO = re.compile(r'^(\*+)([ \t]*)(TODO |DONE )?(.*$)')
+
+def count_stars(line):
+    if not line.startswith('*'):
+        return 0
+
+    return line.split(' ')[0].count('*')
+
+class OutlineIndex:
+    """
+    Sorted array of the outline (heading) lines of a buffer.
+
+    All rows are 0-indexed buffer rows. Headings are referred to by their position in 'rows'.
+
+    rows: buffer row of each heading, ascending
+    levels: number of stars of each heading
+    parents: heading index of the parent of each heading, or -1
+    next_siblings: heading index of the next heading at the same level under the same parent, or -1
+    subtree_ends: buffer row one past the last line of each heading's subtree
+    """
+    def __init__(self, lines, changedtick=None):
+        self.changedtick = changedtick
+        self.num_lines = len(lines)
+        self.rows = [row for row, line in enumerate(lines) if line.startswith('*')]
+        self.levels = [count_stars(lines[row]) for row in self.rows]
+        self._link()
+
+    def apply_changes(self, changes, read_lines):
+        """
+        Patch the index after lines were changed, without rescanning unchanged lines.
+
+        changes: sequence of (first, end, added), in the order the changes were made. Each says that rows first to
+        end - 1 (numbered as they were just before that change) were replaced by end - first + added rows.
+
+        read_lines(first, end): returns rows first to end - 1 of the buffer as it is after all the changes.
+        """
+        dirty = []  # [first, end) row ranges whose headings are unknown, renumbered as each change is applied
+
+        for first, end, added in changes:
+            # Drop the headings which were in the changed range, and move the later ones.
+            lo = bisect_left(self.rows, first)
+            hi = bisect_left(self.rows, end)
+            del self.rows[lo:hi]
+            del self.levels[lo:hi]
+            if added:
+                self.rows[lo:] = [row + added for row in self.rows[lo:]]
+            self.num_lines += added
+
+            def renumber(row, is_end):
+                if row < first or (is_end and row == first):
+                    return row
+                elif row >= end:
+                    return row + added
+                return first if not is_end else end + added
+
+            dirty = [(renumber(d_first, False), renumber(d_end, True)) for d_first, d_end in dirty]
+            dirty.append((first, end + added))
+
+        for first, end in sorted(dirty):
+            if first >= end:
+                continue
+
+            lines = read_lines(first, end)
+            new_rows = [row for row, line in enumerate(lines, first) if line.startswith('*')]
+
+            lo = bisect_left(self.rows, first)
+            hi = bisect_left(self.rows, end)
+            self.rows[lo:hi] = new_rows
+            self.levels[lo:hi] = [count_stars(lines[row - first]) for row in new_rows]
+
+        self._link()
+
+    def _link(self):
+        """
+        Compute the parent, next sibling and subtree end of every heading from 'rows' and 'levels'.
+        """
+        self._fold_levels = None
+
+        num_headings = len(self.rows)
+        self.parents = [-1] * num_headings
+        self.next_siblings = [-1] * num_headings
+        self.subtree_ends = [self.num_lines] * num_headings
+
+        open_headings = []  # stack of headings whose subtree hasn't ended yet
+        for heading, level in enumerate(self.levels):
+            while open_headings and self.levels[open_headings[-1]] >= level:
+                closed = open_headings.pop()
+                self.subtree_ends[closed] = self.rows[heading]
+                if self.levels[closed] == level:
+                    self.next_siblings[closed] = heading
+
+            if open_headings:
+                self.parents[heading] = open_headings[-1]
+            open_headings.append(heading)
+
+    def heading_at_or_above(self, row):
+        """
+        Returns the index of the closest heading at or above 'row', or -1 if there isn't one.
+        """
+        return bisect_right(self.rows, row) - 1
+
+    def row_at_or_above(self, row):
+        """
+        Returns the buffer row of the closest heading at or above 'row', or -1 if there isn't one.
+        """
+        heading = self.heading_at_or_above(row)
+        return self.rows[heading] if heading != -1 else -1
+
+    def level_at_or_above(self, row):
+        """
+        Returns the number of stars of the closest heading at or above 'row', or 0 if there isn't one.
+        """
+        heading = self.heading_at_or_above(row)
+        return self.levels[heading] if heading != -1 else 0
+
+    def subtree_range(self, row):
+        """
+        Returns (first, end) buffer rows of the subtree of the heading at or above 'row', or None if there isn't one.
+
+        The subtree runs until the next heading with the same number of stars or fewer.
+        """
+        heading = self.heading_at_or_above(row)
+        if heading == -1:
+            return None
+
+        return self.rows[heading], self.subtree_ends[heading]
+
+    def end_of_siblings(self, row):
+        """
+        Returns the buffer row after the subtree of the last sibling following the heading at or above 'row', i.e.
+        the row of the first subsequent heading with fewer stars (or the end of the buffer).
+        """
+        heading = self.heading_at_or_above(row)
+        if heading == -1:
+            return self.num_lines
+
+        while self.next_siblings[heading] != -1:
+            heading = self.next_siblings[heading]
+
+        return self.subtree_ends[heading]
+
+    def fold_rows(self, row):
+        """
+        Returns the rows of the headings in the subtree of the heading at or above 'row' (including that heading) whose
+        folds have more than one line, with each heading after all the headings under it.
+        """
+        heading = self.heading_at_or_above(row)
+        if heading == -1:
+            return []
+
+        end = bisect_left(self.rows, self.subtree_ends[heading])
+        headings = [sub for sub in range(heading, end) if self.subtree_ends[sub] - self.rows[sub] > 1]
+        headings.sort(key=lambda sub: self.levels[sub], reverse=True)
+        return [self.rows[sub] for sub in headings]
+
+    def fold_levels(self):
+        """
+        Returns the fold level of every line, as 'foldexpr' gives it: '>N' on a heading with N stars (which starts a
+        fold), N on the other lines under it, and 0 before the first heading.
+        """
+        if self._fold_levels is None:
+            levels = [0] * (self.rows[0] if self.rows else self.num_lines)
+            for heading, row in enumerate(self.rows):
+                level = self.levels[heading]
+                end = self.rows[heading + 1] if heading + 1 < len(self.rows) else self.num_lines
+                levels.append('>%d' % (level,))
+                levels.extend([level] * (end - row - 1))
+            self._fold_levels = levels
+
+        return self._fold_levels
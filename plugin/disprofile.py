@@ -0,0 +1,116 @@
+"""
+Profiling of the Python commands, for :DisProfile.
+
+While profiling is on, each dis_* function which Vim calls (i.e. each one in the __main__ namespace, where
+plugin/disorganiser.vim imports them) is replaced by a wrapper which times it. Turning profiling off puts the original
+functions back, so there is no cost at all when it isn't in use.
+"""
+import cProfile
+import functools
+import io
+import pstats
+import time
+
+import __main__
+import vim
+
+# Number of cProfile entries shown in the report.
+PROFILE_ENTRIES = 40
+
+class _Profile:
+    def __init__(self, use_cprofile):
+        self.originals = {}  # name -> the function which was in __main__
+        self.wrappers = {}  # name -> its wrapper
+        self.times = {}  # name -> list of wall-clock times of each call, in seconds
+        self.profiler = cProfile.Profile() if use_cprofile else None
+        self.depth = 0  # number of wrapped calls in progress
+        self.started = time.perf_counter()
+
+    def wrap(self, name, fn):
+        times = self.times.setdefault(name, [])
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            profiler = self.profiler if self.depth == 0 else None
+            self.depth += 1
+            if profiler is not None:
+                profiler.enable()
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                times.append(time.perf_counter() - start)
+                if profiler is not None:
+                    profiler.disable()
+                self.depth -= 1
+
+        self.originals[name] = fn
+        self.wrappers[name] = wrapper
+        return wrapper
+
+    def report(self):
+        """
+        Returns the summary, as a list of lines.
+        """
+        lines = ['Disorganiser profile: %.1fs' % (time.perf_counter() - self.started,), '']
+        lines.append('%-40s %6s %10s %10s %10s %10s' % ('function', 'calls', 'total ms', 'mean ms', 'median ms',
+                                                          'max ms'))
+
+        called = [(name, times) for name, times in self.times.items() if times]
+        called.sort(key=lambda item: sum(item[1]), reverse=True)
+        for name, times in called:
+            total = sum(times)
+            median = sorted(times)[len(times) // 2]
+            lines.append('%-40s %6d %10.3f %10.3f %10.3f %10.3f' % (
+                name, len(times), total * 1000, total * 1000 / len(times), median * 1000, max(times) * 1000))
+
+        if not called:
+            lines.append('(nothing was called)')
+
+        if self.profiler is not None and called:
+            stream = io.StringIO()
+            stats = pstats.Stats(self.profiler, stream=stream)
+            stats.sort_stats('cumulative').print_stats(PROFILE_ENTRIES)
+            lines.append('')
+            lines.extend(stream.getvalue().rstrip().splitlines())
+
+        return lines
+
+_profile = None
+
+def _start(use_cprofile):
+    global _profile
+    _profile = _Profile(use_cprofile)
+
+    for name, value in list(vars(__main__).items()):
+        if name.startswith('dis_') and name != 'dis_profile' and callable(value):
+            setattr(__main__, name, _profile.wrap(name, value))
+
+def _stop():
+    global _profile
+    profile, _profile = _profile, None
+
+    for name, original in profile.originals.items():
+        if getattr(__main__, name, None) is profile.wrappers[name]:
+            setattr(__main__, name, original)
+
+    return profile
+
+def _show_in_scratch_buffer(lines):
+    vim.command('new')
+    vim.command('setlocal buftype=nofile bufhidden=wipe noswapfile nobuflisted nowrap')
+    vim.current.buffer[:] = lines
+    vim.command('setlocal nomodified')
+
+def dis_profile(bang=''):
+    """
+    Toggle profiling. When it is turned off, show what was recorded in a scratch buffer.
+
+    With bang ('!') when turning it on, also record cProfile statistics.
+    """
+    if _profile is None:
+        _start(bang == '!')
+        print('Disorganiser profiling on%s. Use :DisProfile again to see the results.' % (
+            ' (with cProfile)' if bang == '!' else '',))
+    else:
+        _show_in_scratch_buffer(_stop().report())
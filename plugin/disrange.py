@@ -0,0 +1,154 @@
+"""
+Aggregates (sum, count, minimum, maximum) over ranges of a table column or row.
+
+Values are kept in flat arrays alongside running totals, so that a sum or count over any range of the line takes
+constant time, and nothing needs to go back to the table cells.
+"""
+import decimal
+from array import array
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from disexpr import EmptyCell
+
+INEXACT_TYPES = (float, decimal.Decimal)
+NUMBER_TYPES = (int,) + INEXACT_TYPES
+
+UNAVAILABLE = object()  # returned by the 'read' function of a LineAggregate
+
+class LineAggregate:
+    """
+    Running totals over the values of one table column (or row), read in order from the start of the line.
+
+    read(position) returns the value at that position along the line, or UNAVAILABLE if it can't be read
+    (either because there is no such cell, or because its value isn't known yet). If it raises an exception,
+    the value is counted as failed (see 'failed'), and reading carries on.
+
+    Ranges are given as [first, end) positions along the line. Empty cells are ignored. Ranges summed
+    entirely from ints use the running totals; ranges including Decimals or floats are added up from the
+    array of numbers in the same order as sum() would, so that the result is identical.
+    """
+    def __init__(self, read):
+        self._read = read
+        self.length = 0  # number of values read so far
+
+        self.numbers = array('q')  # every number, in order (becomes a list if they aren't all 64-bit ints)
+
+        # Running totals: entry k is the total over the first k values.
+        self.numeric = array('q', [0])  # how many are numbers; also the index into 'numbers' of position k
+        self.inexact = array('q', [0])  # how many are Decimals or floats
+        self.other = array('q', [0])  # how many are neither numbers nor empty (including failed ones)
+        self.failed = array('q', [0])  # how many couldn't be read because of an exception
+        self.int_sums = array('q', [0])  # sum of the ints (becomes a list if it overflows)
+
+    def extend(self, end):
+        """
+        Read values up to position 'end'. Returns False if they aren't all available.
+        """
+        while self.length < end:
+            try:
+                value = self._read(self.length)
+            except Exception:
+                value = UNAVAILABLE
+                self.failed.append(self.failed[-1] + 1)
+            else:
+                if value is UNAVAILABLE:
+                    return False
+                self.failed.append(self.failed[-1])
+
+            self._append(value)
+
+        return True
+
+    def _append(self, value):
+        numeric = self.numeric[-1]
+        inexact = self.inexact[-1]
+        other = self.other[-1]
+        int_sum = self.int_sums[-1]
+
+        if type(value) is int:
+            self._append_number(value)
+            numeric += 1
+            int_sum += value
+        elif isinstance(value, INEXACT_TYPES):
+            self._append_number(value)
+            numeric += 1
+            inexact += 1
+        elif not isinstance(value, EmptyCell):  # (including UNAVAILABLE, for failed values)
+            other += 1
+
+        self.numeric.append(numeric)
+        self.inexact.append(inexact)
+        self.other.append(other)
+        try:
+            self.int_sums.append(int_sum)
+        except OverflowError:
+            self.int_sums = list(self.int_sums)
+            self.int_sums.append(int_sum)
+
+        self.length += 1
+
+    def _append_number(self, value):
+        try:
+            self.numbers.append(value)
+        except (TypeError, OverflowError):
+            self.numbers = list(self.numbers)
+            self.numbers.append(value)
+
+    def has_failed(self, first, end):
+        """
+        Returns True if any value in the range couldn't be read because of an exception.
+        """
+        return self.failed[end] != self.failed[first]
+
+    def sum(self, first, end):
+        """
+        Returns the sum of the range, or None if it contains something other than numbers and empty cells.
+        """
+        if self.other[end] != self.other[first]:
+            return None
+
+        return self.numeric_sum(first, end)
+
+    def numeric_sum(self, first, end):
+        """
+        Returns the sum of the numbers in the range, ignoring everything else.
+        """
+        if self.inexact[end] == self.inexact[first]:
+            return self.int_sums[end] - self.int_sums[first]
+
+        return sum(self.numbers[self.numeric[first]:self.numeric[end]])
+
+    def count(self, first, end):
+        """
+        Returns how many numbers there are in the range.
+        """
+        return self.numeric[end] - self.numeric[first]
+
+    def min(self, first, end):
+        """
+        Returns the smallest number in the range, or None if there are no numbers in it.
+        """
+        return self._extreme(first, end, min, 'min')
+
+    def max(self, first, end):
+        """
+        Returns the largest number in the range, or None if there are no numbers in it.
+        """
+        return self._extreme(first, end, max, 'max')
+
+    def _extreme(self, first, end, fn, numpy_method):
+        lo = self.numeric[first]
+        hi = self.numeric[end]
+        if lo == hi:
+            return None
+
+        if numpy is not None and isinstance(self.numbers, array):
+            # All 64-bit ints, so look at them in place. (The view mustn't outlive this call, as the array
+            # can't grow while it exists.)
+            return int(getattr(numpy.frombuffer(self.numbers, dtype=numpy.int64)[lo:hi], numpy_method)())
+
+        return fn(self.numbers[lo:hi])
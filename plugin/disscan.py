@@ -0,0 +1,292 @@
+"""
+Reading many disorganiser files, for the commands which look at a whole directory of them (such as :DisAgenda).
+
+Each file is read into records (see scan_lines), which are kept in an sqlite database (see ScanCache) so that a file
+is only read again once it has changed. The files which have changed are read in a pool of worker processes (see
+Scanner), so that Vim needn't wait for them.
+
+This module doesn't use Vim.
+"""
+import concurrent.futures
+import multiprocessing
+import os
+import re
+import shutil
+import sqlite3
+import sys
+
+from disoutline import RE_TODO, count_stars
+
+DATE_RE = re.compile(r'<([0-9]{4}-[0-9]{2}-[0-9]{2})(?: [A-Za-z]{3})?>')
+TAG_RE = re.compile(r':([A-Za-z0-9._@:]+):')
+WORD_RE = re.compile(r'\w+')
+FILE_SUFFIX = '.dis'
+
+def scan_lines(lines):
+    """
+    Returns a record of every heading in 'lines', and of every other line with a date on it.
+
+    Each is (row, level, state, date, tags, text): 'row' is 0-indexed; 'level' is the number of stars, or 0 for a line
+    which isn't a heading; 'state' is 'TODO', 'DONE' or ''; 'date' is the first date on the line, as 'YYYY-MM-DD', or
+    None; 'tags' are the tags of a heading, as ':tag1:tag2:', or ''; and 'text' is the line without its stars or
+    state.
+    """
+    records = []
+    for row, line in enumerate(lines):
+        date_match = DATE_RE.search(line)
+        date = date_match.group(1) if date_match is not None else None
+        if line.startswith('*'):
+            _stars, _whitespace, todo, text = RE_TODO.match(line).groups()
+            names = [name for match in TAG_RE.finditer(text) for name in match.group(1).split(':') if name]
+            records.append((row, count_stars(line), todo.rstrip() if todo is not None else '', date,
+                            ':%s:' % (':'.join(names),) if names else '', text.strip()))
+        elif date is not None:
+            records.append((row, 0, '', date, '', line.strip()))
+
+    return records
+
+def heading_words(text):
+    """
+    Returns the words of 'text', lower-cased, each once, in order. Headings are indexed by these words.
+    """
+    return list(dict.fromkeys(word.lower() for word in WORD_RE.findall(text)))
+
+def parse_file(path):
+    """
+    Returns (path, mtime_ns, size, records) for the file at 'path', with its records as given by scan_lines. If the
+    file can't be read, they are all None.
+    """
+    try:
+        # Look at the file before reading it, so that a change made while it's read is seen by the next scan.
+        stat = os.stat(path)
+        with open(path, encoding='utf-8', errors='replace') as f:
+            lines = f.read().split('\n')
+    except OSError:
+        return path, None, None, None
+
+    return path, stat.st_mtime_ns, stat.st_size, scan_lines(lines)
+
+def parse_files(paths):
+    return [parse_file(path) for path in paths]
+
+def find_files(directory):
+    """
+    Returns {path: (mtime_ns, size)} of the disorganiser files anywhere under 'directory'.
+    """
+    files = {}
+    for dirpath, dirnames, filenames in os.walk(directory):
+        dirnames[:] = [name for name in dirnames if not name.startswith('.')]
+        for filename in filenames:
+            if filename.endswith(FILE_SUFFIX):
+                path = os.path.join(dirpath, filename)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue  # (removed since it was listed)
+                files[path] = (stat.st_mtime_ns, stat.st_size)
+    return files
+
+def default_cache_path():
+    cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cache_home, 'disorganiser', 'scan.sqlite3')
+
+def under(directory):
+    """
+    Returns an SQL condition, and its parameters, for the 'path' column (of the 'files' table of a ScanCache) naming a
+    file under 'directory'.
+    """
+    prefix = os.path.join(directory, '')
+    return 'substr(path, 1, ?) = ?', (len(prefix), prefix)
+
+class ScanCache:
+    """
+    The records of each file, in an sqlite database, with the modification time and size the file had when it was
+    read. A file whose modification time or size has moved on is read again.
+
+    The database can be queried directly through 'db'. The 'files' table gives each file's 'id' and 'path'. The
+    'records' table has a 'file' column (the id) and a column for each part of a record. The headings are indexed by
+    the words of their text (see heading_words): the 'words' table gives each word's 'id', and 'word_headings' has a
+    row (word id, file id, row) for each word of each heading.
+
+    The records keep their text, although it's in the file, as it's what the commands show: reading it back from the
+    files would cost more than all the rest of a query.
+    """
+    SCHEMA_VERSION = 3
+
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.db = sqlite3.connect(path)
+        self._word_ids = {}  # word -> id, of the words looked up so far
+        if self.db.execute('PRAGMA user_version').fetchone()[0] != self.SCHEMA_VERSION:
+            with self.db:
+                self.db.executescript('''
+                    DROP TABLE IF EXISTS files;
+                    DROP TABLE IF EXISTS records;
+                    DROP TABLE IF EXISTS words;
+                    DROP TABLE IF EXISTS word_headings;
+                    CREATE TABLE files (id INTEGER PRIMARY KEY, path TEXT UNIQUE, mtime_ns INTEGER, size INTEGER);
+                    CREATE TABLE records (file INTEGER, row INTEGER, level INTEGER, state TEXT, date TEXT, tags TEXT,
+                                          text TEXT, PRIMARY KEY (file, row)) WITHOUT ROWID;
+                    CREATE TABLE words (id INTEGER PRIMARY KEY, word TEXT UNIQUE);
+                    CREATE TABLE word_headings (word INTEGER, file INTEGER, row INTEGER, PRIMARY KEY (word, file, row))
+                        WITHOUT ROWID;
+                    PRAGMA user_version = %d;
+                ''' % (self.SCHEMA_VERSION,))
+
+    def close(self):
+        self.db.close()
+
+    def changes(self, directory):
+        """
+        Returns (stale, removed): the files under 'directory' which need reading, and the files which were read
+        before but are no longer there.
+        """
+        files = find_files(directory)
+        condition, params = under(directory)
+        cached = {path: (mtime_ns, size) for path, mtime_ns, size
+                  in self.db.execute('SELECT path, mtime_ns, size FROM files WHERE ' + condition, params)}
+        stale = sorted(path for path, version in files.items() if cached.get(path) != version)
+        removed = sorted(path for path in cached if path not in files)
+        return stale, removed
+
+    def update(self, parsed, removed=()):
+        """
+        Store the results of parse_file for some files, and forget the files in 'removed'.
+        """
+        with self.db:
+            for path in removed:
+                self._forget(path)
+            for path, mtime_ns, size, records in parsed:
+                if records is None:
+                    self._forget(path)
+                    continue
+
+                file_id = self._clear(path)
+                self.db.execute('UPDATE files SET mtime_ns = ?, size = ? WHERE id = ?', (mtime_ns, size, file_id))
+                self.db.executemany('INSERT INTO records VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                    [(file_id,) + record for record in records])
+                self.db.executemany('INSERT OR IGNORE INTO word_headings VALUES (?, ?, ?)',
+                                    [(self._word_id(word), file_id, row) for row, level, _state, _date, _tags, text
+                                     in records if level for word in heading_words(text)])
+
+    def _word_id(self, word):
+        """
+        Returns the id of 'word', adding it to the words table if it's new. (Words are never removed, so that ids
+        can be remembered.)
+        """
+        word_id = self._word_ids.get(word)
+        if word_id is None:
+            found = self.db.execute('SELECT id FROM words WHERE word = ?', (word,)).fetchone()
+            if found is None:
+                word_id = self.db.execute('INSERT INTO words (word) VALUES (?)', (word,)).lastrowid
+            else:
+                word_id, = found
+            self._word_ids[word] = word_id
+        return word_id
+
+    def _clear(self, path):
+        """
+        Delete the records and words of the file at 'path', and return its id (adding it, if it's new).
+        """
+        found = self.db.execute('SELECT id FROM files WHERE path = ?', (path,)).fetchone()
+        if found is None:
+            return self.db.execute('INSERT INTO files (path) VALUES (?)', (path,)).lastrowid
+
+        file_id, = found
+        # The index is only ordered by word, so find the words to delete from the headings being deleted.
+        headings = self.db.execute('SELECT text FROM records WHERE file = ? AND level > 0', (file_id,)).fetchall()
+        self.db.executemany('DELETE FROM word_headings WHERE word = ? AND file = ?',
+                            {(self._word_id(word), file_id) for text, in headings for word in heading_words(text)})
+        self.db.execute('DELETE FROM records WHERE file = ?', (file_id,))
+        return file_id
+
+    def _forget(self, path):
+        self.db.execute('DELETE FROM files WHERE id = ?', (self._clear(path),))
+
+    def scan(self, directory):
+        """
+        Bring the cache up to date with the files under 'directory', reading the changed files here. Returns how
+        many had to be read.
+        """
+        stale, removed = self.changes(directory)
+        self.update(parse_files(stale), removed)
+        return len(stale)
+
+def _find_python():
+    """
+    Returns the path of a Python interpreter of the same version as this one, or None.
+
+    In Vim, sys.executable is Vim itself, so look next to the Python installation, and then on the PATH.
+    """
+    if os.path.basename(sys.executable).lower().startswith('python'):
+        return sys.executable
+
+    if sys.platform == 'win32':
+        candidates = [os.path.join(sys.exec_prefix, 'python.exe')]
+    else:
+        name = 'python%d.%d' % sys.version_info[:2]
+        candidates = [os.path.join(sys.exec_prefix, 'bin', name), shutil.which(name)]
+    for candidate in candidates:
+        if candidate and os.path.isfile(candidate) and os.access(candidate, os.X_OK):
+            return candidate
+    return None
+
+def _make_executor(jobs):
+    """
+    Returns a pool of 'jobs' (None: one per CPU) worker processes.
+
+    The workers are new Python processes (see _find_python), rather than forks of this one: in Vim, a fork would be
+    a copy of Vim, with its signal handlers and open files (such as the cache). If there's no Python to run, threads
+    are used instead (which still keeps the reading out of the way of Vim).
+    """
+    python = _find_python()
+    if python is None:
+        return concurrent.futures.ThreadPoolExecutor(max_workers=jobs)
+
+    context = multiprocessing.get_context('spawn')
+    # (This is for every spawned process, not just these, but anything else spawned would need it too.)
+    context.set_executable(python)
+    return concurrent.futures.ProcessPoolExecutor(max_workers=jobs, mp_context=context)
+
+class Scanner:
+    """
+    Reads files with parse_file in a pool of workers, a batch of files at a time. Nothing waits for them: poll()
+    takes whatever has been read so far.
+    """
+    BATCH_SIZE = 32
+
+    def __init__(self, paths, jobs=None):
+        self.num_files = len(paths)
+        self.num_read = 0
+        self._executor = _make_executor(jobs)
+        self._pending = [self._executor.submit(parse_files, paths[first:first + self.BATCH_SIZE])
+                         for first in range(0, len(paths), self.BATCH_SIZE)]
+
+    def poll(self):
+        """
+        Returns the results of parse_file for the files read since the last call.
+        """
+        results = []
+        pending = []
+        for future in self._pending:
+            if future.done():
+                results.extend(future.result())
+            else:
+                pending.append(future)
+
+        self._pending = pending
+        self.num_read += len(results)
+        if not pending:
+            self.close()
+        return results
+
+    @property
+    def finished(self):
+        return not self._pending
+
+    def close(self):
+        """
+        Stop the workers, dropping any files not read yet.
+        """
+        self._pending = []
+        self._executor.shutdown(wait=False, cancel_futures=True)
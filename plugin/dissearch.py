@@ -0,0 +1,45 @@
+"""
+Searching for headings by the words in them, across a directory of disorganiser files.
+
+The headings are indexed by disscan, which keeps the index in its cache (the 'words' and 'word_headings' tables of a
+ScanCache).
+
+This module doesn't use Vim.
+"""
+from disscan import heading_words, under
+
+def search_headings(cache, query, directory, limit=100):
+    """
+    Returns the (at most 'limit') headings of the files under 'directory' with the words of 'query' in them, best
+    first, as (path, row, level, state, text). 'cache' is a disscan.ScanCache.
+
+    The last word of the query also matches the words it starts, so that the query needn't be finished. Headings
+    with more of the words rank higher, then those with more of them exactly, then earlier ones.
+    """
+    words = heading_words(query)
+    if not words:
+        return []
+
+    # One row for each word of the query found in a heading, saying whether it was found exactly.
+    found = []
+    params = []
+    for word in words[:-1]:
+        found.append('SELECT file, row, 1 AS exact FROM word_headings '
+                     'WHERE word = (SELECT id FROM words WHERE word = ?)')
+        params.append(word)
+    found.append('SELECT file, row, max(words.word = ?) AS exact '
+                 'FROM words JOIN word_headings ON word_headings.word = words.id '
+                 'WHERE words.word >= ? AND words.word < ? GROUP BY file, row')
+    params.extend([words[-1], words[-1], words[-1] + '\U0010ffff'])
+
+    condition, directory_params = under(directory)
+    return cache.db.execute(
+        'SELECT path, records.row, level, state, text FROM ('
+        '    SELECT file, row, count(*) AS matched, sum(exact) AS exact'
+        '    FROM (' + ' UNION ALL '.join(found) + ')'
+        '    WHERE file IN (SELECT id FROM files WHERE ' + condition + ')'
+        '    GROUP BY file, row ORDER BY matched DESC, exact DESC, file, row LIMIT ?'
+        ') AS best JOIN files ON files.id = best.file '
+        'JOIN records ON records.file = best.file AND records.row = best.row '
+        'ORDER BY matched DESC, exact DESC, path, records.row',
+        params + list(directory_params) + [limit]).fetchall()
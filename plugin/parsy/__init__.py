@@ -45,27 +45,45 @@ class ParseError(RuntimeError):
             return 'expected one of {} at {}'.format(', '.join(expected_list), self.line_info())
 
 
+_new_tuple = tuple.__new__
+_nothing_expected = frozenset()
+
+
 class Result(namedtuple('Result', 'status index value furthest expected')):
+    # Results are made at every step of a parse, so they are built with tuple.__new__ directly (skipping the
+    # namedtuple constructor), have no __dict__, and are reused rather than copied where possible.
+    __slots__ = ()
+
     @staticmethod
     def success(index, value):
-        return Result(True, index, value, -1, frozenset())
+        return _new_tuple(Result, (True, index, value, -1, _nothing_expected))
 
     @staticmethod
     def failure(index, expected):
-        return Result(False, -1, None, index, frozenset([expected]))
+        return _new_tuple(Result, (False, -1, None, index, frozenset((expected,))))
 
     # collect the furthest failure from self and other
     def aggregate(self, other):
-        if not other:
+        if other is None:
             return self
 
-        if self.furthest > other.furthest:
+        furthest = self[3]
+        other_furthest = other[3]
+        if furthest > other_furthest:
             return self
-        elif self.furthest == other.furthest:
+        elif furthest == other_furthest:
             # if we both have the same failure index, we combine the expected messages.
-            return Result(self.status, self.index, self.value, self.furthest, self.expected | other.expected)
+            expected = self[4]
+            other_expected = other[4]
+            if other_expected <= expected:
+                return self
+            return _new_tuple(Result, (self[0], self[1], self[2], furthest, expected | other_expected))
         else:
-            return Result(self.status, self.index, self.value, other.furthest, other.expected)
+            return _new_tuple(Result, (self[0], self[1], self[2], other_furthest, other[4]))
+
+    def with_value(self, value):
+        """The same result, but with a different value."""
+        return _new_tuple(Result, (self[0], self[1], value, self[3], self[4]))
 
 
 class Parser(object):
@@ -81,13 +99,16 @@ class Parser(object):
 
     def __init__(self, wrapped_fn):
         self.wrapped_fn = wrapped_fn
+        self._until_eof = None
 
     def __call__(self, stream, index):
         return self.wrapped_fn(stream, index)
 
     def parse(self, stream):
         """Parse a string or list of tokens and return the result or raise a ParseError."""
-        (result, _) = (self << eof).parse_partial(stream)
+        if self._until_eof is None:
+            self._until_eof = self << eof
+        (result, _) = self._until_eof.parse_partial(stream)
         return result
 
     def parse_partial(self, stream):
@@ -117,10 +138,17 @@ class Parser(object):
         return bound_parser
 
     def map(self, map_fn):
-        return self.bind(lambda res: success(map_fn(res)))
+        @Parser
+        def map_parser(stream, index):
+            result = self(stream, index)
+            if result.status:
+                return result.with_value(map_fn(result.value))
+            return result
+
+        return map_parser
 
     def combine(self, combine_fn):
-        return self.bind(lambda res: success(combine_fn(*res)))
+        return self.map(lambda res: combine_fn(*res))
 
     def combine_dict(self, combine_fn):
         return self.bind(lambda res: success(combine_fn(**{k: v for k, v in dict(res).items()
@@ -4,6 +4,46 @@ if exists("b:current_syntax")
 	finish
 endif
 
+" Explicitly defining colours. Yes! Very naughty.
+" ctermfg colours are derived from the hex using this gist:
+" https://gist.github.com/MicahElliott/719710#gistcomment-1442838
+hi Normal ctermbg=0 ctermfg=231
+hi disH1 ctermfg=210 guifg=#FF7799
+hi disH2 ctermfg=222 guifg=#FFCA91
+hi disH3 ctermfg=213 guifg=#FF8BFA
+hi disH4 ctermfg=68 guifg=#7390E8
+hi disH5 ctermfg=215 guifg=#FDAD57
+hi disH6 ctermfg=211 guifg=#F57CBB
+hi disH7 ctermfg=151 guifg=#B2DABB
+hi disH8 ctermfg=68 guifg=#707DE0
+hi disUL ctermfg=135 guifg=#bc66ff
+hi disTODO ctermfg=0 ctermbg=173 guifg=#000000 guibg=#E9954C gui=bold cterm=bold
+hi disDONE ctermfg=77 guifg=#66EB66 gui=bold cterm=bold
+hi disLink ctermfg=209 guifg=#EC9A40
+hi disDate ctermfg=44 guifg=#00CECE
+hi disTag ctermfg=167 guifg=#EA4C5A
+hi disSubtle ctermfg=59 guifg=#444444
+hi disHidden ctermfg=bg guifg=bg
+hi disFoldStart ctermfg=bg guifg=bg
+hi disFoldEnd ctermfg=bg guifg=bg
+hi disTableBar ctermfg=61 guifg=#6345A0
+hi disTR ctermfg=104 guifg=#778Ad6
+hi disTableFormula ctermfg=98 guifg=#7A67c6
+hi link disTableName disTableFormula
+hi disQuote1 ctermfg=73 guifg=#67b2a4
+hi disQuote2 ctermfg=107 guifg=#8bb569
+hi disQuote3 ctermfg=143 guifg=#a9b569
+hi disLiteral ctermfg=157 guifg=#b4edb1
+
+" Large files are highlighted with text properties instead, following the same rules (see plugin/dishighlight.py),
+" as these get slow.
+if has('textprop') && has('python3')
+	\ && line2byte(line('$') + 1) > get(g:, 'disorganiser_textprop_threshold', 1000000)
+	call disorganiser#highlight()
+	let b:current_syntax = "disorganiser"
+	finish
+endif
+
 syn cluster disInline contains=disTag,disTODO,disDONE,disLink,disDate,disFoldStart,disFoldEnd
 
 syn match disTag ':[A-Za-z0-9._@:]\+:'
@@ -47,35 +87,6 @@ syn region disTR start="^[ \t]*|" end="$" contains=@disInline,disTableBar,disTab
 "      the formula. If we end with | (end of cell), don't highlight it.
 syn region disTableFormula start="[ \t]*=" end="=\|\(|\)\@=" contained
 syn match disTableBar '|' contained
-
-" Explicitly defining colours. Yes! Very naughty.
-" ctermfg colours are derived from the hex using this gist:
-" https://gist.github.com/MicahElliott/719710#gistcomment-1442838
-hi Normal ctermbg=0 ctermfg=231
-hi disH1 ctermfg=210 guifg=#FF7799
-hi disH2 ctermfg=222 guifg=#FFCA91
-hi disH3 ctermfg=213 guifg=#FF8BFA
-hi disH4 ctermfg=68 guifg=#7390E8
-hi disH5 ctermfg=215 guifg=#FDAD57
-hi disH6 ctermfg=211 guifg=#F57CBB
-hi disH7 ctermfg=151 guifg=#B2DABB
-hi disH8 ctermfg=68 guifg=#707DE0
-hi disUL ctermfg=135 guifg=#bc66ff
-hi disTODO ctermfg=0 ctermbg=173 guifg=#000000 guibg=#E9954C gui=bold cterm=bold
-hi disDONE ctermfg=77 guifg=#66EB66 gui=bold cterm=bold
-hi disLink ctermfg=209 guifg=#EC9A40
-hi disDate ctermfg=44 guifg=#00CECE
-hi disTag ctermfg=167 guifg=#EA4C5A
-hi disSubtle ctermfg=59 guifg=#444444
-hi disHidden ctermfg=bg guifg=bg
-hi disFoldStart ctermfg=bg guifg=bg
-hi disFoldEnd ctermfg=bg guifg=bg
-hi disTableBar ctermfg=61 guifg=#6345A0
-hi disTR ctermfg=104 guifg=#778Ad6
-hi disTableFormula ctermfg=98 guifg=#7A67c6
-hi disQuote1 ctermfg=73 guifg=#67b2a4
-hi disQuote2 ctermfg=107 guifg=#8bb569
-hi disQuote3 ctermfg=143 guifg=#a9b569
-hi disLiteral ctermfg=157 guifg=#b4edb1
+syn match disTableName '^[ \t]*#[A-Za-z_][A-Za-z0-9_]*[ \t]*$'
 
 let b:current_syntax = "disorganiser"